@@ -0,0 +1,59 @@
+"""Перезаписывает фикстуры бенчмарков живыми ответами Pinterest.
+
+    python bench/record.py [путь к pinterest_cookies.pkl]
+
+Берет первый аккаунт из файла кук, сохраняет главную страницу ленты и
+следующую страницу API. В ответах есть данные аккаунта — перед коммитом
+их стоит просмотреть.
+"""
+import asyncio
+import json
+import os
+import pickle
+import sys
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+from bot_complete import (  # noqa: E402
+    HTTP_HEADERS, PINTEREST_RESOURCE_PATH, PINTEREST_URL, normalize_cookie_pool, parse_home_page
+)
+
+
+async def record(cookies_file: str):
+    with open(cookies_file, 'rb') as f:
+        pool = normalize_cookie_pool(pickle.load(f))
+    if not pool:
+        raise SystemExit("В файле нет кук")
+    cookies = next(iter(pool.values()))
+    fixtures = os.path.join(BENCH_DIR, 'fixtures')
+
+    async with aiohttp.ClientSession(headers=HTTP_HEADERS, cookies=cookies) as session:
+        async with session.get(PINTEREST_URL) as resp:
+            resp.raise_for_status()
+            html = await resp.text()
+        with open(os.path.join(fixtures, 'home.html'), 'w', encoding='utf-8') as f:
+            f.write(html)
+        pins, bookmark = parse_home_page(html)
+        print(f"home.html: {len(html) // 1024} КБ, пинов {len(pins)}")
+        if not bookmark:
+            print("Курсора следующей страницы нет, resource.json не обновлен")
+            return
+
+        params = {
+            'source_url': '/',
+            'data': json.dumps({'options': {'bookmarks': [bookmark]}, 'context': {}}, separators=(',', ':'))
+        }
+        headers = {'Accept': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
+        async with session.get(PINTEREST_URL + PINTEREST_RESOURCE_PATH, params=params, headers=headers) as resp:
+            resp.raise_for_status()
+            body = await resp.read()
+        with open(os.path.join(fixtures, 'resource.json'), 'wb') as f:
+            f.write(body)
+        print(f"resource.json: {len(body) // 1024} КБ")
+
+
+if __name__ == '__main__':
+    asyncio.run(record(sys.argv[1] if len(sys.argv) > 1 else 'pinterest_cookies.pkl'))
@@ -0,0 +1,389 @@
+"""Офлайн-бенчмарки бота на заглушках Pinterest и Bot API.
+
+    python bench/run.py                              # все сценарии, отчет в stdout
+    python bench/run.py --scenario feed --users 100 --out before.json
+    python bench/run.py --compare before.json after.json
+
+Каждый сценарий идет в отдельном процессе со своим временным каталогом,
+поэтому память и кэши одного сценария не влияют на другой. Отчет — JSON
+с отсортированными ключами, его удобно сравнивать между коммитами.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import platform
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import stubs  # noqa: E402
+
+TOKEN = '123456:bench'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def http(url: str, method: str = 'GET'):
+    request = urllib.request.Request(url, method=method, data=b'' if method == 'POST' else None)
+    with urllib.request.urlopen(request, timeout=5) as resp:
+        return json.loads(resp.read())
+
+
+def percentiles(values) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, max(0, int(round(p / 100 * len(values) + 0.5)) - 1))]
+    return {name: round(rank(p) * 1000, 2) for name, p in (('p50', 50), ('p95', 95), ('p99', 99), ('max', 100))}
+
+
+# ===== Апдейты =====
+
+def user(uid: int) -> dict:
+    return {'id': uid, 'is_bot': False, 'first_name': f'bench{uid}'}
+
+
+def message_update(update_id: int, uid: int, text: str) -> dict:
+    message = {
+        'message_id': update_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': uid, 'type': 'private'}, 'from': user(uid)
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def callback_update(update_id: int, uid: int, data: str) -> dict:
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(update_id), 'from': user(uid), 'chat_instance': str(uid), 'data': data,
+        'message': {'message_id': 1, 'date': int(time.time()), 'text': 'Меню',
+                    'chat': {'id': uid, 'type': 'private'}}
+    }}
+
+
+class Driver:
+    """Подает апдейты в бота так же, как это делает Application: через процессор апдейтов"""
+
+    def __init__(self, bot):
+        from telegram import Update
+        self.Update = Update
+        self.bot = bot
+        self.application = bot.application
+        self.update_ids = iter(range(1, 10 ** 9))
+        self.errors = 0
+        self.application.add_error_handler(self.on_error)
+
+    async def on_error(self, update, context):
+        self.errors += 1
+
+    async def send(self, payload) -> float:
+        update = self.Update.de_json(payload(next(self.update_ids)), self.application.bot)
+        start = time.perf_counter()
+        await self.application.update_processor.process_update(update, self.application.process_update(update))
+        return time.perf_counter() - start
+
+    async def tap(self, uid: int, data: str) -> float:
+        return await self.send(lambda update_id: callback_update(update_id, uid, data))
+
+    async def write(self, uid: int, text: str) -> float:
+        return await self.send(lambda update_id: message_update(update_id, uid, text))
+
+
+# ===== Сценарии =====
+
+async def scenario_feed(driver: Driver, args) -> dict:
+    """users пользователей одновременно жмут «🔄 Еще» taps раз подряд"""
+    latencies = []
+
+    async def session(uid):
+        for tap in range(args.taps):
+            latencies.append(await driver.tap(uid, 'menu_avatars'))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(uid) for uid in range(1, args.users + 1)))
+    return {'requests': len(latencies), 'duration': time.perf_counter() - start, 'latencies': latencies}
+
+
+async def scenario_notes(driver: Driver, args) -> dict:
+    """users пользователей одновременно сохраняют по notes заметок"""
+    latencies = []
+
+    async def session(uid):
+        for i in range(args.notes):
+            await driver.tap(uid, 'menu_notes')
+            latencies.append(await driver.write(uid, f'Заметка {i}\n' + 'текст заметки ' * 20))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(session(uid) for uid in range(1, args.users + 1)))
+    return {'requests': len(latencies), 'duration': time.perf_counter() - start, 'latencies': latencies}
+
+
+async def scenario_digest(driver: Driver, args) -> dict:
+    """Рассылка категории users подписчикам: время до последней доставки"""
+    bot = driver.bot
+    for uid in range(1, args.users + 1):
+        await bot.broadcasts.subscribe(uid, 'avatars')
+    latencies = []
+    deliver = bot.deliver
+
+    async def timed(*deliver_args):
+        started = time.perf_counter()
+        await deliver(*deliver_args)
+        latencies.append(time.perf_counter() - started)
+    bot.deliver = timed
+
+    start = time.perf_counter()
+    await bot.create_digest('avatars', 0)
+    for broadcast_id, category, urls in await bot.broadcasts.unfinished():
+        await bot.send_broadcast(broadcast_id, category, urls)
+    return {'requests': len(latencies), 'duration': time.perf_counter() - start, 'latencies': latencies}
+
+
+async def scenario_restart(driver: Driver, args) -> dict:
+    """Перезапуск: старт и первые выдачи ленты users новым пользователям без теплого снимка и с ним"""
+    import bot_complete
+    bot = driver.bot
+    await asyncio.gather(*(driver.tap(uid, 'menu_avatars') for uid in range(1, args.users + 1)))
+    bot.save_state()
+    bot.save_warm_state()
+    snapshot = bot.warm_state.path
+
+    report = {}
+    for mode, first_uid in (('cold', args.users + 1), ('warm', 2 * args.users + 1)):
+        if mode == 'cold':
+            os.replace(snapshot, snapshot + '.keep')
+        else:
+            os.replace(snapshot + '.keep', snapshot)
+        start = time.perf_counter()
+        restarted = bot_complete.TelegramBot(TOKEN)
+        second = Driver(restarted)
+        await restarted.application.initialize()
+        await restarted.post_init(restarted.application)
+        startup = time.perf_counter() - start
+
+        # Отправку в Telegram снимок не ускоряет, поэтому меряем саму выдачу ленты
+        latencies = []
+        get_my_feed = restarted.pinterest.get_my_feed
+
+        async def timed(*feed_args, **feed_kwargs):
+            started = time.perf_counter()
+            try:
+                return await get_my_feed(*feed_args, **feed_kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+        restarted.pinterest.get_my_feed = timed
+
+        start = time.perf_counter()
+        try:
+            await asyncio.gather(*(second.tap(uid, 'menu_avatars') for uid in range(first_uid, first_uid + args.users)))
+        finally:
+            duration = time.perf_counter() - start
+            await restarted.post_shutdown(restarted.application)
+            await restarted.application.shutdown()
+        report[mode] = {'startup_ms': round(startup * 1000, 1), 'feed_ms': percentiles(latencies),
+                        'refills': restarted.pinterest.feed_cache.stats['refills']}
+    return dict(report, requests=len(latencies), duration=duration, latencies=latencies)
+
+
+SCENARIOS = {
+    'feed': scenario_feed,
+    'notes': scenario_notes,
+    'digest': scenario_digest,
+    'restart': scenario_restart,
+}
+
+
+# ===== Процесс сценария =====
+
+def metric_total(metric) -> dict:
+    return {','.join(key) or 'total': value for key, value in sorted(metric.values.items())}
+
+
+async def run_scenario(name: str, args) -> dict:
+    import bot_complete
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    bot = bot_complete.TelegramBot(TOKEN)
+    driver = Driver(bot)
+    await bot.application.initialize()
+    await bot.post_init(bot.application)
+    try:
+        result = await SCENARIOS[name](driver, args)
+    finally:
+        await bot.post_shutdown(bot.application)
+        await bot.application.shutdown()
+
+    latencies = result.pop('latencies')
+    duration = result.pop('duration')
+    return dict(
+        result,
+        errors=driver.errors,
+        duration_s=round(duration, 3),
+        throughput_rps=round(result['requests'] / duration, 2) if duration else 0,
+        latency_ms=percentiles(latencies),
+        rss_peak_mb=round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        fallbacks=metric_total(bot_complete.FALLBACK_TOTAL),
+        deliveries=metric_total(bot_complete.DIGEST_DELIVERIES_TOTAL),
+        send_failures=metric_total(bot_complete.SEND_FAILURES_TOTAL),
+        feed_cache=dict(bot.pinterest.feed_cache.stats),
+    )
+
+
+def worker(args):
+    """Выполняется в дочернем процессе: свой каталог, свои файлы данных, свой бот"""
+    os.chdir(tempfile.mkdtemp(prefix='bench-'))
+    os.environ.update({
+        'PINTEREST_URL': args.pinterest_url,
+        'TELEGRAM_API_URL': args.api_url,
+        'METRICS_PORT': '0',
+        'STORAGE_BACKEND': args.storage,
+        'DIGEST_INTERVAL': '0',  # рассылку сценарий запускает сам
+    })
+    os.environ.pop('REDIS_URL', None)
+    os.environ.pop('WEBHOOK_URL', None)
+    with open('pinterest_cookies.pkl', 'wb') as f:
+        pickle.dump({f'bench{i}': {'sid': f'bench{i}'} for i in range(args.accounts)}, f)
+    sys.path.insert(0, ROOT)
+    print(json.dumps(asyncio.run(run_scenario(args.worker, args))))
+
+
+# ===== Запуск и сравнение =====
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run_all(args) -> dict:
+    pinterest_port, api_port = free_port(), free_port()
+    server = multiprocessing.Process(
+        target=stubs.run, args=(pinterest_port, api_port, args.api_latency, args.api_429, args.retry_after,
+                                args.pinterest_latency),
+        daemon=True
+    )
+    server.start()
+    api_stats = f'http://127.0.0.1:{api_port}/stats'
+    for _ in range(100):
+        try:
+            http(api_stats)
+            break
+        except OSError:
+            time.sleep(0.05)
+
+    params = {key: value for key, value in vars(args).items()
+              if key not in ('compare', 'out', 'scenario', 'worker', 'pinterest_url', 'api_url')}
+    report = {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(), 'params': params},
+        'scenarios': {}
+    }
+    names = list(SCENARIOS) if args.scenario == 'all' else [args.scenario]
+    try:
+        for name in names:
+            for url in (api_stats, f'http://127.0.0.1:{pinterest_port}/stats'):
+                http(url.replace('/stats', '/reset'), 'POST')
+            command = [sys.executable, os.path.abspath(__file__), '--worker', name,
+                       '--pinterest-url', f'http://127.0.0.1:{pinterest_port}/',
+                       '--api-url', f'http://127.0.0.1:{api_port}/bot']
+            for key, value in params.items():
+                command += [f"--{key.replace('_', '-')}", str(value)]
+            done = subprocess.run(command, capture_output=True, text=True)
+            if done.returncode != 0:
+                sys.stderr.write(done.stderr)
+                raise SystemExit(f"Сценарий {name} завершился с ошибкой")
+            result = json.loads(done.stdout.strip().splitlines()[-1])
+            result['bot_api'] = http(api_stats)
+            result['pinterest'] = http(f'http://127.0.0.1:{pinterest_port}/stats')
+            report['scenarios'][name] = result
+            print(f"{name}: {result['throughput_rps']} rps, p50 {result['latency_ms'].get('p50')} мс, "
+                  f"p99 {result['latency_ms'].get('p99')} мс, RSS {result['rss_peak_mb']} МБ", file=sys.stderr)
+    finally:
+        server.terminate()
+        server.join()
+    return report
+
+
+def flatten(data, prefix='') -> dict:
+    items = {}
+    for key, value in data.items():
+        path = f'{prefix}.{key}' if prefix else key
+        if isinstance(value, dict):
+            items.update(flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[path] = value
+    return items
+
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, encoding='utf-8') as f:
+        old = flatten(json.load(f)['scenarios'])
+    with open(new_path, encoding='utf-8') as f:
+        new = flatten(json.load(f)['scenarios'])
+    width = max(map(len, set(old) | set(new)), default=10)
+    for key in sorted(set(old) | set(new)):
+        before, after = old.get(key), new.get(key)
+        if before is not None and after is not None and before:
+            delta = f'{(after - before) / before * 100:+.1f}%'
+        else:
+            delta = ''
+        print(f'{key:<{width}}  {before if before is not None else "—":>12}  '
+              f'{after if after is not None else "—":>12}  {delta:>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Офлайн-бенчмарки бота')
+    parser.add_argument('--scenario', default='all', choices=['all'] + list(SCENARIOS))
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--taps', type=int, default=5, help='нажатий «Еще» на пользователя')
+    parser.add_argument('--notes', type=int, default=20, help='заметок на пользователя')
+    parser.add_argument('--accounts', type=int, default=2, help='аккаунтов Pinterest в пуле')
+    parser.add_argument('--storage', default='sqlite', choices=['sqlite', 'journal'])
+    parser.add_argument('--api-latency', type=float, default=0.02, help='задержка Bot API, секунды')
+    parser.add_argument('--api-429', type=float, default=0.01, help='доля ответов 429')
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--pinterest-latency', type=float, default=0.05)
+    parser.add_argument('--out', help='куда записать JSON (по умолчанию stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--pinterest-url', help=argparse.SUPPRESS)
+    parser.add_argument('--api-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.worker:
+        worker(args)
+        return
+
+    report = json.dumps(run_all(args), indent=2, sort_keys=True, ensure_ascii=False)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    main()
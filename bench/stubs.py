@@ -0,0 +1,215 @@
+"""Локальные заглушки для бенчмарков: Pinterest на записанных страницах и Bot API Telegram.
+
+Запуск вручную:
+    python bench/stubs.py --pinterest-port 8701 --api-port 8702 --api-latency 0.02 --api-429 0.01
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import struct
+import time
+import zlib
+from collections import Counter
+
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+PINIMG = 'https://i.pinimg.com/'
+SHAPES = [(736, 736), (736, 1308), (1920, 1080), (564, 1002), (1200, 675)]
+THUMB = '236x'  # вариант, который бот скачивает для перцептивного хеша
+SEND_METHODS = {'sendPhoto', 'sendMediaGroup', 'sendMessage', 'editMessageText'}
+
+
+def png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def png_header(width: int, height: int, color: int = 2) -> bytes:
+    """Начало PNG-файла: подпись и IHDR — этого хватает, чтобы узнать размеры"""
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color, 0, 0, 0))
+
+
+def png_image(width: int, height: int, seed: bytes) -> bytes:
+    """Целая серая картинка: сетка 8x8 плиток случайной яркости, у разных seed — разные dHash"""
+    rnd = random.Random(seed)
+    rows = [b'\x00' + bytes(cells[x * 8 // width] for x in range(width))
+            for cells in ([rnd.randrange(256) for _ in range(8)] for _ in range(8))]
+    raw = b''.join(rows[y * 8 // height] for y in range(height))
+    return png_header(width, height, 0) + png_chunk(b'IDAT', zlib.compress(raw)) + png_chunk(b'IEND', b'')
+
+
+class PinterestStub:
+    """Отдает записанные страницы ленты.
+
+    Ссылки на i.pinimg.com переписываются на саму заглушку с номером ответа
+    в пути, поэтому каждая загрузка ленты приносит новые картинки, а пробы
+    размеров попадают сюда же.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        with open(os.path.join(FIXTURES, 'home.html'), encoding='utf-8') as f:
+            self.home = f.read()
+        with open(os.path.join(FIXTURES, 'resource.json'), encoding='utf-8') as f:
+            self.resource = f.read()
+        self.responses = itertools.count(1)
+        self.calls = Counter()
+        self.app = web.Application()
+        self.app.router.add_get('/', self.handle_home)
+        self.app.router.add_get('/resource/UserHomefeedResource/get/', self.handle_resource)
+        self.app.router.add_get('/i.pinimg.com/{path:.*}', self.handle_image)
+        self.app.router.add_get('/stats', self.handle_stats)
+        self.app.router.add_post('/reset', self.handle_reset)
+
+    def rewrite(self, body: str, request: web.Request) -> str:
+        base = f'http://{request.host}/i.pinimg.com/{next(self.responses)}/'
+        return body.replace(PINIMG, base)
+
+    async def handle_home(self, request: web.Request) -> web.Response:
+        self.calls['home'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(text=self.rewrite(self.home, request), content_type='text/html')
+
+    async def handle_resource(self, request: web.Request) -> web.Response:
+        self.calls['resource'] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.Response(text=self.rewrite(self.resource, request), content_type='application/json')
+
+    async def handle_image(self, request: web.Request) -> web.Response:
+        digest = hashlib.md5(request.match_info['path'].encode()).digest()
+        if f'/{THUMB}/' in request.path:
+            self.calls['thumbnail'] += 1
+            return web.Response(body=png_image(236, 236, digest), content_type='image/png')
+        self.calls['image'] += 1
+        width, height = SHAPES[digest[0] % len(SHAPES)]
+        status = 206 if 'Range' in request.headers else 200
+        return web.Response(status=status, body=png_header(width, height), content_type='image/png')
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.calls))
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        return web.json_response(True)
+
+
+class FakeBotApi:
+    """Bot API Telegram в миниатюре: отвечает правдоподобными объектами, считает вызовы,
+    добавляет задержку и с вероятностью rate_429 отвечает Too Many Requests."""
+
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.message_ids = itertools.count(1)
+        self.calls = Counter()
+        self.throttled = 0
+        self.app = web.Application()
+        self.app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self.app.router.add_get('/stats', self.handle_stats)
+        self.app.router.add_post('/reset', self.handle_reset)
+
+    async def params(self, request: web.Request) -> dict:
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            if isinstance(value, str):
+                try:
+                    value = json.loads(value)
+                except ValueError:
+                    pass
+            params[key] = value
+        return params
+
+    def message(self, chat_id, **extra) -> dict:
+        return dict(message_id=next(self.message_ids), date=int(time.time()),
+                    chat={'id': int(chat_id or 1), 'type': 'private'}, **extra)
+
+    @staticmethod
+    def photo(source) -> list:
+        file_id = 'bench-' + hashlib.sha1(str(source).encode()).hexdigest()[:24]
+        return [{'file_id': file_id, 'file_unique_id': file_id[-12:], 'width': 1280, 'height': 1280}]
+
+    def result(self, method: str, params: dict):
+        chat_id = params.get('chat_id')
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method == 'sendPhoto':
+            return self.message(chat_id, photo=self.photo(params.get('photo')), caption=params.get('caption'))
+        if method == 'sendMediaGroup':
+            return [self.message(chat_id, photo=self.photo(item.get('media'))) for item in params.get('media', [])]
+        if method in ('sendMessage', 'editMessageText'):
+            return self.message(chat_id, text=params.get('text', ''))
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self.params(request)
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if method in SEND_METHODS and self.random.random() < self.rate_429:
+            self.throttled += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+        return web.json_response({'ok': True, 'result': self.result(method, params)})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'calls': dict(self.calls), 'throttled': self.throttled})
+
+    async def handle_reset(self, request: web.Request) -> web.Response:
+        self.calls.clear()
+        self.throttled = 0
+        return web.json_response(True)
+
+
+async def serve(pinterest_port: int, api_port: int, api_latency: float = 0.0, api_429: float = 0.0,
+                retry_after: int = 1, pinterest_latency: float = 0.0):
+    runners = []
+    for app, port in ((PinterestStub(pinterest_latency).app, pinterest_port),
+                      (FakeBotApi(api_latency, api_429, retry_after).app, api_port)):
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        runners.append(runner)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for runner in runners:
+            await runner.cleanup()
+
+
+def run(*args, **kwargs):
+    """Точка входа для отдельного процесса"""
+    try:
+        asyncio.run(serve(*args, **kwargs))
+    except KeyboardInterrupt:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pinterest-port', type=int, default=8701)
+    parser.add_argument('--api-port', type=int, default=8702)
+    parser.add_argument('--api-latency', type=float, default=0.0)
+    parser.add_argument('--api-429', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1)
+    parser.add_argument('--pinterest-latency', type=float, default=0.0)
+    args = parser.parse_args()
+    print(f"Pinterest: http://127.0.0.1:{args.pinterest_port}/  Bot API: http://127.0.0.1:{args.api_port}/bot")
+    run(args.pinterest_port, args.api_port, args.api_latency, args.api_429, args.retry_after, args.pinterest_latency)
+
+
+if __name__ == '__main__':
+    main()
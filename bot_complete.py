@@ -1,21 +1,48 @@
+import time
+STARTED = time.perf_counter()  # отсюда профиль запуска считает время импорта
+
 import os
 import logging
 import json
+import math
+import multiprocessing
+import hashlib
+import hmac
+import importlib.util
+import io
+import itertools
 import asyncio
 import aiohttp
+import bisect
 import pickle
 import random
 import re
+import shutil
+import signal
+import sqlite3
+import struct
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Tuple
-from bs4 import BeautifulSoup
+from html import unescape
+from urllib.parse import urlparse
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+from aiohttp import web
+
+# bs4, lxml и Pillow импортируются при первом использовании: на старте они не нужны
+HAS_LXML = importlib.util.find_spec('lxml') is not None
+HAS_PIL = importlib.util.find_spec('PIL') is not None
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
@@ -29,134 +56,2530 @@ logger = logging.getLogger(__name__)
 
 # Конфигурация
 DATA_FILE = 'bot_data.json'
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')  # sqlite или journal
+JOURNAL_COMPACT_OPS = 1000  # после стольких операций журнал сжимается в снимок
+JOURNAL_LOADED_USERS = 1000  # журналов пользователей, которые держим в памяти
+LEGACY_OWNER = os.getenv('OWNER_ID', '')  # кому отдать записи из старого общего bot_data.json
+PAGE_SIZE = 10              # записей на страницу в меню
 COOKIES_FILE = 'pinterest_cookies.pkl'
+FILE_IDS_FILE = 'file_ids.json'
+SEEN_FILE = 'seen_images.bin'
+SAVE_INTERVAL = 60          # как часто сбрасывать кэши на диск, секунды
 GAMES = ['CS2', 'Standoff 2', 'Valorant']
 
+# Пул HTTP-соединений к Pinterest
+PINTEREST_URL = os.getenv('PINTEREST_URL', 'https://ru.pinterest.com/')
+HTTP_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+HTTP_LIMIT = 100            # всего соединений
+HTTP_LIMIT_PER_HOST = 20    # соединений на один хост
+HTTP_KEEPALIVE = 60         # сколько секунд держать простаивающее соединение
+HTTP_DNS_TTL = 300          # кэш DNS, секунды
+
+# Буфер ленты
+CATEGORIES = ('avatars', 'wallpapers_pc', 'wallpapers_phone')
+FEED_TTL = 15 * 60          # сколько секунд ссылка живет в буфере
+FEED_POOL_SIZE = 300        # максимум ссылок на категорию
+FEED_LOW_WATER = 30         # ниже этого буфер дозаполняется в фоне
+
+# Просмотренные картинки
+SEEN_CAPACITY = 50000       # сколько последних картинок помним на пользователя
+SEEN_FP_RATE = 0.01         # доля новых картинок, которые ошибочно сочтем просмотренными
+SEEN_FIRST_LAYER = 256      # емкость первого слоя фильтра (дальше удваивается)
+SEEN_MAX_LAYERS = 8         # на сколько слоев делим допустимую долю ошибок
+
+# Определение формата картинок
+ASPECT_TOLERANCE = 1.2          # w/h выше — горизонтальная, ниже 1/1.2 — вертикальная, между — квадрат
+IMAGE_SIZE_CACHE = 50000        # url -> размеры, записей
+IMAGE_PROBE_BYTES = 64 * 1024   # сколько байт читать, чтобы найти размеры в заголовке
+IMAGE_PROBE_CONCURRENCY = 16    # одновременных Range-запросов
+
+# Похожие картинки: одну и ту же работу под разными ссылками и в разных размерах показываем один раз
+PHASH_DEDUP = os.getenv('PHASH_DEDUP', '1') == '1'  # нужен Pillow; без него этап пропускается
+PHASH_FILE = 'image_hashes.bin'  # url -> хеш и группа, переживает перезапуск
+PHASH_CACHE = 50000             # записей url -> хеш
+PHASH_INDEX = 50000             # различных хешей в индексе поиска похожих
+PHASH_DISTANCE = 6              # хеши, отличающиеся не больше чем на столько бит из 64, — одна картинка
+PHASH_THUMB = '236x'            # вариант картинки, по которому считается хеш
+PHASH_MAX_BYTES = 512 * 1024    # больше этого миниатюру не читаем
+PHASH_CONCURRENCY = 16          # одновременных загрузок миниатюр
+
+# Отправка в Telegram
+MEDIA_GROUP_SIZE = 10       # максимум фото в одном альбоме
+TG_GLOBAL_RATE = 30         # сообщений в секунду на весь бот
+TG_CHAT_RATE = 1            # сообщений в секунду в личный чат
+TG_GROUP_RATE = 20 / 60     # сообщений в секунду в группу
+TG_CHAT_BURST = 3           # сколько сообщений в чат можно отправить подряд без паузы
+TG_CHAT_BUCKETS = 10000     # чатов, для которых помним лимит
+FILE_ID_CACHE = 100000      # url -> file_id, записей
+
+# Подписки и рассылка свежих пинов
+BROADCAST_FILE = 'broadcast.sqlite3'
+DIGEST_INTERVAL = int(os.getenv('DIGEST_INTERVAL', str(24 * 3600)))  # раз в столько секунд; 0 — выключено
+DIGEST_SIZE = 5             # фото в одной рассылке
+DIGEST_RATE = 20            # сообщений в секунду на рассылку (остальное — живым пользователям)
+DIGEST_CONCURRENCY = 8      # одновременных отправок рассылки
+DIGEST_CHECK = 60           # как часто проверять, не пора ли рассылать, секунды
+DIGEST_CLAIM_TIMEOUT = 600  # доставка, взятая копией и не отмеченная за столько секунд, снова в очереди (Redis)
+DIGEST_KEEP = 7 * 24 * 3600  # сколько Redis помнит законченную рассылку
+CATEGORY_LABELS = {'avatars': '👤 Аватарки', 'wallpapers_pc': '🖥️ Обои ПК', 'wallpapers_phone': '📱 Обои телефон'}
+
+# Обработка апдейтов
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')  # другой адрес — для тестов
+UPDATE_WORKERS = 32         # сколько апдейтов обрабатываем одновременно
+UPDATE_BACKLOG = 10000      # сколько апдейтов могут ждать своей очереди (за пользователем или за воркером)
+FEED_CALLBACKS = ('menu_avatars', 'menu_pc', 'menu_phone')
+
+# Вебхук (если WEBHOOK_URL не задан — работаем опросом)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')            # внешний адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')      # по умолчанию выводится из токена
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))  # процессов на одной машине
+
+# Общее состояние (диалоги, просмотренные, буфер ленты, куки) для нескольких копий бота
+REDIS_URL = os.getenv('REDIS_URL')                # например redis://localhost:6379/0
+REDIS_PREFIX = os.getenv('REDIS_PREFIX', 'tgbot:')
+REDIS_POOL_SIZE = 10
+USER_STATE_TTL = 7 * 24 * 3600  # состояние диалога забываем через неделю бездействия
+
+# Источник пинов: json (встроенное состояние страницы и постраничный API) или html (только <img>)
+PINTEREST_MODE = os.getenv('PINTEREST_MODE', 'json')
+PINTEREST_RESOURCE_PATH = 'resource/UserHomefeedResource/get/'
+
+# Пул аккаунтов Pinterest (каждый загруженный файл кук — отдельный аккаунт)
+IDENTITY_RATE = 0.5               # запросов ленты в секунду на аккаунт
+IDENTITY_BURST = 3                # сколько запросов подряд без паузы
+IDENTITY_BACKOFF_BASE = 30        # пауза после первого 429/403, секунды (дальше удваивается)
+IDENTITY_BACKOFF_MAX = 15 * 60    # потолок паузы
+IDENTITY_QUARANTINE_AFTER = 5     # после стольких отказов подряд аккаунт уходит в карантин
+IDENTITY_QUARANTINE_TIME = 6 * 3600
+
+# Устойчивость запросов к Pinterest
+PINTEREST_CONNECT_TIMEOUT = 5     # установка соединения, секунды
+PINTEREST_READ_TIMEOUT = 10       # пауза между кусками ответа
+PINTEREST_TOTAL_TIMEOUT = 20      # весь запрос целиком
+FETCH_ATTEMPTS = 3                # попыток на запрос (повторяем только сбои сети и 5xx)
+FETCH_RETRY_BASE = 0.5            # минимальная пауза перед повтором, секунды
+FETCH_RETRY_CAP = 5               # максимальная пауза перед повтором
+FEED_DEADLINE = 30                # дольше пользователь ленту не ждет — отдаем заглушки
+BREAKER_FAILURES = 5              # сбоев подряд, после которых Pinterest считаем недоступным
+BREAKER_RESET = 30                # через сколько секунд пробуем снова
+
+# Метрики в формате Prometheus на локальном /metrics
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9090'))  # 0 — выключено; воркер i слушает METRICS_PORT + i
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)  # секунды
+
+# Перезапуск (процесс перезапускается по расписанию, см. .github/workflows/bot_new.yml)
+WARM_STATE_FILE = 'warm_state.bin'  # буфер ленты, диалоги и кэши между запусками
+STARTUP_PROFILE = os.getenv('STARTUP_PROFILE') == '1'  # печатать время каждой фазы запуска
+
+# Разбор HTML: regex (быстрый), lxml (если установлен) или bs4 (запасной)
+HTML_EXTRACTOR = os.getenv('HTML_EXTRACTOR', 'regex')
+
+
+def is_feed_image(src: str) -> bool:
+    return 'pinimg.com' in src and '236x' in src
+
+
+# Комментарии, <script> и <style> пропускаем целиком — как и html.parser,
+# который не видит внутри них тегов
+_HTML_SKIP_OR_IMG = re.compile(
+    r'<!--.*?-->|<(script|style)\b.*?</\1\s*>|<img\b((?:[^>"\']|"[^"]*"|\'[^\']*\')*)>',
+    re.IGNORECASE | re.DOTALL
+)
+_HTML_ATTR = re.compile(
+    r'([^\s=/>"\']+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>"\']+)))?'
+)
+
+
+def extract_images_regex(html: str) -> List[str]:
+    """Потоковый разбор регулярками: смотрим только теги <img>"""
+    images = []
+    for match in _HTML_SKIP_OR_IMG.finditer(html):
+        attrs = match.group(2)
+        if not attrs or 'pinimg.com' not in attrs:
+            continue
+        src = None
+        for name, dq, sq, bare in _HTML_ATTR.findall(attrs):
+            # При повторе атрибута html.parser оставляет последнее значение
+            if name.lower() == 'src':
+                src = unescape(dq or sq or bare)
+        if src is not None and is_feed_image(src):
+            images.append(src)
+    return images
+
+
+def extract_images_lxml(html: str) -> List[str]:
+    import lxml.html
+    doc = lxml.html.fromstring(html)
+    return [src for src in (img.get('src') for img in doc.iter('img')) if src and is_feed_image(src)]
+
+
+def extract_images_soup(html: str) -> List[str]:
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+    return [
+        src for src in (img.get('src', '') for img in soup.find_all('img', {'src': True}))
+        if is_feed_image(src)
+    ]
+
+
+HTML_EXTRACTORS = {
+    'regex': extract_images_regex,
+    'lxml': extract_images_lxml,
+    'bs4': extract_images_soup
+}
+
+
+def extract_images(html: str, name: str = None) -> List[str]:
+    """Ссылки pinimg 236x из <img src> в порядке документа"""
+    name = name or HTML_EXTRACTOR
+    if name == 'lxml' and not HAS_LXML:
+        name = 'regex'
+    extractor = HTML_EXTRACTORS.get(name, extract_images_soup)
+    try:
+        return extractor(html)
+    except Exception as e:
+        if extractor is extract_images_soup:
+            raise
+        logger.error(f"Ошибка разбора ({name}), пробую bs4: {e}")
+        return extract_images_soup(html)
+
+
+def image_size_from_header(data: bytes) -> Optional[Tuple[int, int]]:
+    """Ширина и высота JPEG/PNG/GIF/WebP по первым байтам файла"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+        return struct.unpack('>II', data[16:24])
+    
+    if data[:4] == b'GIF8' and len(data) >= 10:
+        return struct.unpack('<HH', data[6:10])
+    
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP' and len(data) >= 30:
+        chunk = data[12:16]
+        if chunk == b'VP8 ':
+            width, height = struct.unpack('<HH', data[26:30])
+            return width & 0x3FFF, height & 0x3FFF
+        if chunk == b'VP8L':
+            bits = struct.unpack('<I', data[21:25])[0]
+            return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b'VP8X':
+            return int.from_bytes(data[24:27], 'little') + 1, int.from_bytes(data[27:30], 'little') + 1
+        return None
+    
+    if data[:2] == b'\xff\xd8':
+        pos = 2
+        while pos + 4 <= len(data):
+            if data[pos] != 0xFF:
+                return None
+            marker = data[pos + 1]
+            if marker == 0xFF:  # заполнитель
+                pos += 1
+                continue
+            if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # маркеры без длины
+                pos += 2
+                continue
+            length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+            # SOF0..SOF15, кроме DHT (C4), JPG (C8) и DAC (CC)
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                if pos + 9 > len(data):
+                    return None
+                height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+                return width, height
+            pos += 2 + length
+    return None
+
+
+# Размер варианта в пути pinimg: /736x/, /originals/, /60x60/, /75x75_RS/ ...
+_PINIMG_VARIANT = re.compile(r'(pinimg\.com/(?:[^/]+/)*?)(?:originals|\d+x\d*(?:_[A-Za-z]+)?)/')
+
+
+def thumbnail_url(url: str) -> Optional[str]:
+    """Маленький вариант картинки pinimg (None для чужих ссылок); миниатюры всегда в JPEG"""
+    match = _PINIMG_VARIANT.search(url)
+    if not match:
+        return None
+    rest = re.sub(r'\.(?:png|gif|webp)$', '.jpg', url[match.end():], flags=re.IGNORECASE)
+    return url[:match.start()] + match.group(1) + PHASH_THUMB + '/' + rest
+
+
+def dhash(data: bytes) -> int:
+    """64-битный разностный хеш (dHash): серая копия 9x8, бит — ярче ли пиксель правого соседа"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        # JPEG сразу декодируется уменьшенным — в разы быстрее полного
+        image.draft('L', (64, 64))
+        pixels = image.convert('L').resize((9, 8), Image.LANCZOS).tobytes()
+    value = 0
+    for row in range(0, 72, 9):
+        for col in range(row, row + 8):
+            value = value << 1 | (pixels[col] > pixels[col + 1])
+    return value
+
+
+async def read_prefix(stream: aiohttp.StreamReader, limit: int,
+                      enough: Callable[[bytearray], object] = None) -> bytes:
+    """Первые limit байт тела ответа (все тело, если оно короче).
+    
+    stream.read(n) отдает только то, что уже пришло по сети — обычно один
+    кусок в несколько КБ, поэтому читаем в цикле до конца тела или лимита.
+    Если задан enough, чтение заканчивается, как только он вернет истину
+    для уже прочитанного.
+    """
+    data = bytearray()
+    while len(data) < limit:
+        chunk = await stream.read(limit - len(data))
+        if not chunk:
+            break
+        data += chunk
+        if enough is not None and enough(data):
+            break
+    return bytes(data)
+
+
+class LRUCache:
+    """Словарь ограниченного размера: при переполнении вытесняется самая давняя запись"""
+    
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+    
+    def get(self, key, default=None):
+        if key in self.items:
+            self.items.move_to_end(key)
+            self.stats['hits'] += 1
+            return self.items[key]
+        self.stats['misses'] += 1
+        return default
+    
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.capacity:
+            self.items.popitem(last=False)
+    
+    def pop(self, key, default=None):
+        return self.items.pop(key, default)
+    
+    def __contains__(self, key) -> bool:
+        return key in self.items
+    
+    def __len__(self) -> int:
+        return len(self.items)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity про запас"""
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def reserve(self, cost: float = 1) -> float:
+        """Забирает токены (в долг, если не хватает) и возвращает, сколько секунд подождать"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        return 0 if self.tokens >= 0 else -self.tokens / self.rate
+    
+    async def acquire(self, cost: float = 1):
+        delay = self.reserve(cost)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class Counter:
+    """Счетчик, который только растет (с метками или без)"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple, float] = {}
+    
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        self.values[key] = self.values.get(key, 0) + amount
+    
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, self.labels, key, value
+
+
+class Gauge(Counter):
+    """Текущее значение; fn, если задана, вызывается при каждом чтении /metrics.
+    
+    fn возвращает число или словарь {значение метки: число} для одной метки.
+    """
+    
+    kind = 'gauge'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Callable = None):
+        super().__init__(name, help, labels)
+        self.fn = fn
+    
+    def set(self, value: float, **labels):
+        self.values[tuple(labels.get(name, '') for name in self.labels)] = value
+    
+    def samples(self):
+        if self.fn is not None:
+            result = self.fn()
+            if isinstance(result, dict):
+                self.values = {(key,): value for key, value in result.items()}
+            else:
+                self.values = {(): result}
+        yield from super().samples()
+
+
+class Histogram:
+    """Распределение длительностей по корзинам METRICS_BUCKETS"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple = METRICS_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values: Dict[Tuple, List] = {}  # метки -> [счетчики корзин..., сумма]
+    
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        row = self.values.get(key)
+        if row is None:
+            row = self.values[key] = [0] * (len(self.buckets) + 2)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+    
+    def time(self, **labels) -> 'Timer':
+        return Timer(self, labels)
+    
+    def samples(self):
+        names = self.labels + ('le',)
+        for key, row in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ('+Inf',), row):
+                total += count
+                yield self.name + '_bucket', names, key + (bound,), total
+            yield self.name + '_sum', self.labels, key, row[-1]
+            yield self.name + '_count', self.labels, key, total
+
+
+class Timer:
+    """with HISTOGRAM.time(): ... — записывает длительность блока"""
+    
+    def __init__(self, histogram: Histogram, labels: Dict):
+        self.histogram = histogram
+        self.labels = labels
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class StartupProfile:
+    """Время фаз запуска: от первого импорта до готовности принимать апдейты"""
+    
+    def __init__(self, started: float):
+        self.last = started
+        self.phases: List[Tuple[str, float]] = []
+        self.done = False
+    
+    def mark(self, phase: str):
+        """Закрывает фазу, которая шла с предыдущей отметки"""
+        if self.done:
+            return
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+    
+    @property
+    def total(self) -> float:
+        return sum(seconds for _, seconds in self.phases)
+    
+    def finish(self):
+        if self.done:
+            return
+        self.done = True
+        logger.info(f"✅ Запуск занял {self.total:.2f} с")
+        if STARTUP_PROFILE:
+            logger.info("Фазы запуска:\n" + self.report())
+    
+    def report(self) -> str:
+        width = max([len(phase) for phase, _ in self.phases] + [5])
+        lines = [f"  {phase:<{width}} {seconds * 1000:8.1f} мс" for phase, seconds in self.phases]
+        return '\n'.join(lines + [f"  {'итого':<{width}} {self.total * 1000:8.1f} мс"])
+
+
+STARTUP = StartupProfile(STARTED)
+
+
+class MetricsRegistry:
+    """Все метрики процесса; render() отдает их в текстовом формате Prometheus"""
+    
+    def __init__(self, prefix: str = 'tgbot_'):
+        self.prefix = prefix
+        self.metrics: Dict[str, object] = {}
+    
+    def register(self, metric):
+        metric.name = self.prefix + metric.name
+        # Повторная регистрация (новый экземпляр бота) заменяет старую
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+    
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), fn: Callable = None) -> Gauge:
+        return self.register(Gauge(name, help, labels, fn))
+    
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Histogram:
+        return self.register(Histogram(name, help, labels))
+    
+    def stats(self, name: str, help: str, label: str, fn: Callable[[], Dict]) -> Gauge:
+        """Словарь счетчиков компонента (его stats) как counter с меткой label"""
+        metric = Gauge(name, help, (label,), fn)
+        metric.kind = 'counter'
+        return self.register(metric)
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logger.error(f"Метрика {metric.name} не собралась: {e}")
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, label_names, label_values, value in samples:
+                labels = ','.join(
+                    '{}="{}"'.format(label, str(label_value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for label, label_value in zip(label_names, label_values)
+                )
+                lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+PINTEREST_FETCH_SECONDS = METRICS.histogram('pinterest_fetch_seconds', 'Запрос к Pinterest с повторами', ('page',))
+PARSE_SECONDS = METRICS.histogram('parse_seconds', 'Разбор страницы ленты', ('page',))
+FORMAT_CHECK_SECONDS = METRICS.histogram('format_check_seconds', 'Отбор пинов по формату вместе с пробой размеров')
+TELEGRAM_SEND_SECONDS = METRICS.histogram('telegram_send_seconds', 'Отправка фото в Telegram', ('method',))
+STORAGE_WRITE_SECONDS = METRICS.histogram('storage_write_seconds', 'Запись в хранилище данных', ('op',))
+STATE_SAVE_SECONDS = METRICS.histogram('state_save_seconds', 'Сброс кэшей на диск')
+SEARCH_SECONDS = METRICS.histogram('search_seconds', 'Поиск /find')
+PHASH_SECONDS = METRICS.histogram('phash_seconds', 'Отсев похожих картинок вместе с хешированием миниатюр')
+DIGEST_DELIVERIES_TOTAL = METRICS.counter('digest_deliveries_total', 'Доставки рассылки', ('category', 'status'))
+FALLBACK_TOTAL = METRICS.counter('fallback_total', 'Выдачи заглушек вместо ленты', ('category', 'reason'))
+DUPLICATES_SKIPPED_TOTAL = METRICS.counter('duplicates_skipped_total', 'Уже просмотренные картинки', ('category',))
+NEAR_DUPLICATES_SKIPPED_TOTAL = METRICS.counter('near_duplicates_skipped_total',
+                                                'Похожие на просмотренные картинки', ('category',))
+SEND_FAILURES_TOTAL = METRICS.counter('send_failures_total', 'Неудачные отправки в Telegram', ('reason',))
+
+
+class Pin(NamedTuple):
+    """Пин из ленты: ссылка на оригинал и его размеры (0, если неизвестны)"""
+    id: Optional[str]
+    url: str
+    width: int = 0
+    height: int = 0
+
+
+_PAGE_STATE = re.compile(
+    r'<script[^>]*\bid=["\'](?:__PWS_DATA__|__PWS_INITIAL_PROPS__)["\'][^>]*>(.*?)</script>',
+    re.IGNORECASE | re.DOTALL
+)
+
+
+def extract_page_state(html: str) -> Optional[dict]:
+    """JSON-состояние, которое Pinterest встраивает в страницу"""
+    match = _PAGE_STATE.search(html)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except ValueError:
+        return None
+
+
+def extract_pins(data) -> List[Pin]:
+    """Все пины из JSON-ответа Pinterest (в порядке обхода, без повторов)"""
+    pins = []
+    seen = set()
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(reversed(node))
+            continue
+        if not isinstance(node, dict):
+            continue
+        images = node.get('images')
+        if isinstance(images, dict) and node.get('type', 'pin') == 'pin':
+            variants = [v for v in images.values() if isinstance(v, dict) and v.get('url')]
+            if variants:
+                best = images.get('orig') if isinstance(images.get('orig'), dict) else None
+                if not best or not best.get('url'):
+                    best = max(variants, key=lambda v: v.get('width') or 0)
+                if best['url'] not in seen:
+                    seen.add(best['url'])
+                    pins.append(Pin(
+                        str(node['id']) if node.get('id') else None,
+                        best['url'],
+                        int(best.get('width') or 0),
+                        int(best.get('height') or 0)
+                    ))
+                continue
+        stack.extend(reversed(list(node.values())))
+    return pins
+
+
+def find_bookmark(data) -> Optional[str]:
+    """Курсор следующей страницы ленты ('-end-' — лента закончилась)"""
+    stack = [data]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list):
+            stack.extend(node)
+        elif isinstance(node, dict):
+            for key in ('nextBookmark', 'bookmark'):
+                value = node.get(key)
+                if isinstance(value, str) and value:
+                    return None if value == '-end-' else value
+            bookmarks = node.get('bookmarks')
+            if isinstance(bookmarks, list) and bookmarks and isinstance(bookmarks[0], str):
+                return None if bookmarks[0] == '-end-' else bookmarks[0]
+            stack.extend(node.values())
+    return None
+
+
+def parse_home_page(html: str, mode: str = None) -> Tuple[List[Pin], Optional[str]]:
+    """Пины и курсор с главной страницы; без JSON — ссылки из <img>"""
+    if (mode or PINTEREST_MODE) == 'json':
+        state = extract_page_state(html)
+        if state is not None:
+            pins = extract_pins(state)
+            if pins:
+                resources = state.get('props', {}).get('initialReduxState', {}).get('resources', {})
+                return pins, find_bookmark(resources.get('UserHomefeedResource') or state)
+    
+    pins = []
+    seen = set()
+    for src in extract_images(html):
+        # Берем максимальное качество
+        high_res = src.replace('236x', '736x')
+        if high_res not in seen:
+            seen.add(high_res)
+            pins.append(Pin(None, high_res))
+    return pins, None
+
+
+def parse_resource_response(body: bytes) -> Tuple[List[Pin], Optional[str]]:
+    """Ответ /resource/UserHomefeedResource/get/"""
+    response = json.loads(body).get('resource_response') or {}
+    return extract_pins(response.get('data')), find_bookmark({'bookmark': response.get('bookmark')})
+
+
+class BloomLayer:
+    """Один слой Bloom-фильтра на capacity элементов"""
+    
+    __slots__ = ('capacity', 'count', 'size', 'hashes', 'bits')
+    
+    def __init__(self, capacity: int, fp_rate: float, count: int = 0, size: int = 0,
+                 hashes: int = 0, bits: bytearray = None):
+        self.capacity = capacity
+        self.count = count
+        self.size = size or max(64, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hashes = hashes or max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.size + 7) // 8)
+    
+    def positions(self, key: int):
+        # Двойное хеширование из одного 64-битного ключа
+        h1, h2 = key & 0xFFFFFFFF, (key >> 32) | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+    
+    def __contains__(self, key: int) -> bool:
+        bits = self.bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self.positions(key))
+    
+    def add(self, key: int):
+        for p in self.positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+        self.count += 1
+    
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class SeenFilter:
+    """Масштабируемый Bloom-фильтр одного пользователя.
+    
+    Слои растут вдвое, пока не дойдут до четверти лимита; когда элементов
+    больше capacity, выбрасывается самый старый слой.
+    """
+    
+    def __init__(self, capacity: int, fp_rate: float, layers: List[BloomLayer] = None):
+        self.capacity = capacity
+        # Ложные срабатывания слоев складываются, поэтому каждому — доля от общего
+        self.fp_rate = fp_rate / SEEN_MAX_LAYERS
+        self.layers = layers or []
+    
+    def __contains__(self, key: int) -> bool:
+        return any(key in layer for layer in reversed(self.layers))
+    
+    def add(self, key: int):
+        if not self.layers or self.layers[-1].full:
+            size = self.layers[-1].capacity * 2 if self.layers else SEEN_FIRST_LAYER
+            self.layers.append(BloomLayer(min(size, max(1, self.capacity // 4)), self.fp_rate))
+        self.layers[-1].add(key)
+        while len(self.layers) > 1 and self.count > self.capacity:
+            self.layers.pop(0)
+    
+    @property
+    def count(self) -> int:
+        return sum(layer.count for layer in self.layers)
+    
+    def memory_bytes(self) -> int:
+        return sum(len(layer.bits) for layer in self.layers)
+
+
+class SeenStore:
+    """Какие картинки пользователь уже видел: 64-битные хеши ссылок в Bloom-фильтрах.
+    
+    Снимок периодически сохраняется на диск, поэтому после перезапуска
+    повторов не будет.
+    """
+    
+    MAGIC = b'SEEN1'
+    
+    def __init__(self, path: str, capacity: int = SEEN_CAPACITY, fp_rate: float = SEEN_FP_RATE):
+        self.path = path
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.users: Dict[str, SeenFilter] = {}
+        self.dirty = False
+        self.load()
+    
+    @staticmethod
+    def key(category: str, url: str) -> int:
+        digest = hashlib.blake2b(f'{category}\0{url}'.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+    
+    def contains(self, user: str, category: str, url: str) -> bool:
+        seen = self.users.get(user)
+        return seen is not None and self.key(category, url) in seen
+    
+    def add(self, user: str, category: str, url: str):
+        seen = self.users.get(user)
+        if seen is None:
+            seen = self.users[user] = SeenFilter(self.capacity, self.fp_rate)
+        seen.add(self.key(category, url))
+        self.dirty = True
+    
+    def memory_bytes(self, user: str = None) -> int:
+        if user is not None:
+            return self.users[user].memory_bytes() if user in self.users else 0
+        return sum(seen.memory_bytes() for seen in self.users.values())
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if not data.startswith(self.MAGIC):
+                raise ValueError("неизвестный формат")
+            pos = len(self.MAGIC)
+            (users,) = struct.unpack_from('<I', data, pos)
+            pos += 4
+            for _ in range(users):
+                name_len, layer_count = struct.unpack_from('<HH', data, pos)
+                pos += 4
+                user = data[pos:pos + name_len].decode('utf-8')
+                pos += name_len
+                layers = []
+                for _ in range(layer_count):
+                    capacity, count, size, hashes = struct.unpack_from('<IIIH', data, pos)
+                    pos += 14
+                    length = (size + 7) // 8
+                    bits = bytearray(data[pos:pos + length])
+                    pos += length
+                    layers.append(BloomLayer(capacity, self.fp_rate, count, size, hashes, bits))
+                self.users[user] = SeenFilter(self.capacity, self.fp_rate, layers)
+            logger.info(f"✅ Просмотренные загружены: {users} пользователей")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить {self.path}: {e}")
+    
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(self.users)))
+            for user, seen in self.users.items():
+                name = user.encode('utf-8')
+                f.write(struct.pack('<HH', len(name), len(seen.layers)))
+                f.write(name)
+                for layer in seen.layers:
+                    f.write(struct.pack('<IIIH', layer.capacity, layer.count, layer.size, layer.hashes))
+                    f.write(layer.bits)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class MemoryState:
+    """Состояние в памяти процесса: подходит, когда бот запущен в одном экземпляре"""
+    
+    shared = False
+    
+    def __init__(self, seen_file: str = SEEN_FILE):
+        self.users: Dict[str, Dict] = {}
+        self.seen = SeenStore(seen_file)
+        self.pools: Dict[str, OrderedDict] = {}
+        self.expired = 0  # ссылок буфера, выброшенных по сроку
+        self.cookies: Optional[Dict] = None
+    
+    async def get_user_state(self, user: str) -> Dict:
+        return dict(self.users.get(user, {}))
+    
+    async def set_user_state(self, user: str, data: Dict):
+        if data:
+            self.users[user] = dict(data)
+        else:
+            self.users.pop(user, None)
+    
+    async def seen_many(self, user: str, category: str, urls: List[str]) -> List[bool]:
+        return [self.seen.contains(user, category, url) for url in urls]
+    
+    async def mark_seen(self, user: str, category: str, urls: List[str]):
+        for url in urls:
+            self.seen.add(user, category, url)
+    
+    def _pool(self, category: str) -> OrderedDict:
+        """Пул категории без просроченных ссылок (url -> время истечения)"""
+        pool = self.pools.setdefault(category, OrderedDict())
+        now = time.time()
+        # Порядок вставки = порядок истечения, поэтому чистим с начала
+        while pool and next(iter(pool.values())) <= now:
+            pool.popitem(last=False)
+            self.expired += 1
+        return pool
+    
+    async def pool_get(self, category: str) -> List[str]:
+        return list(self._pool(category))
+    
+    async def pool_put(self, category: str, urls: List[str], ttl: float, capacity: int):
+        pool = self._pool(category)
+        expires = time.time() + ttl
+        for url in urls:
+            pool.pop(url, None)
+            pool[url] = expires
+        while len(pool) > capacity:
+            pool.popitem(last=False)
+    
+    async def pool_clear(self):
+        self.pools.clear()
+    
+    async def get_cookies(self) -> Optional[Dict]:
+        return self.cookies
+    
+    async def set_cookies(self, cookies: Dict):
+        self.cookies = cookies
+    
+    def memory_report(self) -> str:
+        return f"просмотренные: {len(self.seen.users)} пользователей, {self.seen.memory_bytes() // 1024} КБ"
+    
+    def seen_stats(self) -> Dict[str, int]:
+        return {'users': len(self.seen.users), 'bytes': self.seen.memory_bytes()}
+    
+    def save(self):
+        self.seen.save()
+    
+    def snapshot(self) -> Dict:
+        """Диалоги и буфер ленты для теплого перезапуска (просмотренные сохраняются отдельно)"""
+        return {'users': self.users, 'pools': {category: list(pool.items()) for category, pool in self.pools.items()}}
+    
+    def restore(self, data: Dict):
+        self.users.update(data.get('users', {}))
+        now = time.time()
+        for category, items in data.get('pools', {}).items():
+            pool = self.pools.setdefault(category, OrderedDict())
+            for url, expires in items:
+                if expires > now:
+                    pool[url] = expires
+    
+    async def close(self):
+        pass
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisClient:
+    """Минимальный клиент протокола Redis (RESP2) на asyncio с пулом соединений"""
+    
+    def __init__(self, url: str, pool_size: int = REDIS_POOL_SIZE):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or 'localhost'
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.strip('/') or 0)
+        self.pool_size = pool_size
+        self.idle: List[Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = []
+        self.conns = set()  # все открытые соединения, и свободные, и занятые командами
+        self.created = 0
+        self.closed = False
+        self.released = asyncio.Condition()
+    
+    async def _connect(self):
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        conn = (reader, writer)
+        self.conns.add(conn)
+        try:
+            if self.password:
+                await self._setup(conn, 'AUTH', self.password)
+            if self.db:
+                await self._setup(conn, 'SELECT', self.db)
+        except BaseException:
+            self.conns.discard(conn)
+            writer.close()
+            raise
+        return conn
+    
+    async def _setup(self, conn, *command):
+        reply = (await self._call(conn, [command]))[0]
+        if isinstance(reply, RedisError):
+            raise reply
+    
+    async def _acquire(self):
+        if self.closed:
+            raise RedisError("клиент Redis закрыт")
+        async with self.released:
+            while not self.idle and self.created >= self.pool_size:
+                await self.released.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+        try:
+            return await self._connect()
+        except Exception:
+            await self._discard()
+            raise
+    
+    async def _release(self, conn):
+        if self.closed:
+            # Команда досчиталась уже после close — соединение в пул не возвращаем
+            await self._discard(conn)
+            return
+        async with self.released:
+            self.idle.append(conn)
+            self.released.notify()
+    
+    async def _discard(self, conn=None):
+        if conn is not None:
+            self.conns.discard(conn)
+            conn[1].close()
+        async with self.released:
+            self.created -= 1
+            self.released.notify()
+    
+    @staticmethod
+    def _encode(command) -> bytes:
+        parts = [b'*%d\r\n' % len(command)]
+        for arg in command:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(parts)
+    
+    async def _read(self, reader: asyncio.StreamReader):
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Redis закрыл соединение")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b'+':
+            return rest.decode('utf-8')
+        if kind == b'-':
+            return RedisError(rest.decode('utf-8'))
+        if kind == b':':
+            return int(rest)
+        if kind == b'$':
+            length = int(rest)
+            if length < 0:
+                return None
+            data = await reader.readexactly(length + 2)
+            return data[:-2].decode('utf-8')
+        if kind == b'*':
+            length = int(rest)
+            if length < 0:
+                return None
+            return [await self._read(reader) for _ in range(length)]
+        raise RedisError(f"Непонятный ответ: {line!r}")
+    
+    async def _call(self, conn, commands) -> List:
+        reader, writer = conn
+        writer.write(b''.join(self._encode(c) for c in commands))
+        await writer.drain()
+        return [await self._read(reader) for _ in commands]
+    
+    async def pipeline(self, *commands) -> List:
+        """Отправляет команды одним пакетом и возвращает ответы по порядку"""
+        conn = await self._acquire()
+        try:
+            replies = await self._call(conn, commands)
+        except BaseException:
+            # Соединение в неизвестном состоянии — не возвращаем его в пул
+            await self._discard(conn)
+            raise
+        await self._release(conn)
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+    
+    async def execute(self, *command):
+        return (await self.pipeline(command))[0]
+    
+    async def close(self):
+        """Закрывает все соединения, в том числе занятые командами: те получат ошибку соединения"""
+        self.closed = True
+        async with self.released:
+            conns = list(self.conns)
+            self.conns.clear()
+            self.idle.clear()
+            for _, writer in conns:
+                writer.close()
+        await asyncio.gather(*(writer.wait_closed() for _, writer in conns), return_exceptions=True)
+
+
+class RedisState:
+    """Общее состояние в Redis (или совместимом сервере): для нескольких копий бота"""
+    
+    shared = True
+    
+    def __init__(self, url: str, prefix: str = REDIS_PREFIX, seen_capacity: int = SEEN_CAPACITY):
+        self.redis = RedisClient(url)
+        self.prefix = prefix
+        self.seen_capacity = seen_capacity
+        self.expired = 0  # ссылок буфера, выброшенных по сроку этой копией
+    
+    def key(self, *parts) -> str:
+        return self.prefix + ':'.join(str(p) for p in parts)
+    
+    async def get_user_state(self, user: str) -> Dict:
+        raw = await self.redis.execute('GET', self.key('user', user))
+        return json.loads(raw) if raw else {}
+    
+    async def set_user_state(self, user: str, data: Dict):
+        if data:
+            await self.redis.execute('SET', self.key('user', user), json.dumps(data, ensure_ascii=False),
+                                     'EX', USER_STATE_TTL)
+        else:
+            await self.redis.execute('DEL', self.key('user', user))
+    
+    async def seen_many(self, user: str, category: str, urls: List[str]) -> List[bool]:
+        if not urls:
+            return []
+        members = [SeenStore.key(category, url) for url in urls]
+        flags = await self.redis.execute('SMISMEMBER', self.key('seen', user), *members)
+        return [bool(flag) for flag in flags]
+    
+    async def mark_seen(self, user: str, category: str, urls: List[str]):
+        if not urls:
+            return
+        members = [SeenStore.key(category, url) for url in urls]
+        # Множество — для проверки, список — чтобы забывать самые старые
+        seen, order = self.key('seen', user), self.key('seenq', user)
+        _, length = await self.redis.pipeline(('SADD', seen, *members), ('RPUSH', order, *members))
+        if length > self.seen_capacity:
+            oldest = await self.redis.execute('LPOP', order, length - self.seen_capacity)
+            if oldest:
+                await self.redis.execute('SREM', seen, *oldest)
+    
+    async def pool_get(self, category: str) -> List[str]:
+        key = self.key('feed', category)
+        removed, urls = await self.redis.pipeline(
+            ('ZREMRANGEBYSCORE', key, '-inf', time.time()),
+            ('ZRANGE', key, 0, -1)
+        )
+        self.expired += removed
+        return urls
+    
+    async def pool_put(self, category: str, urls: List[str], ttl: float, capacity: int):
+        if not urls:
+            return
+        key = self.key('feed', category)
+        expires = time.time() + ttl
+        await self.redis.pipeline(
+            ('ZADD', key, *itertools.chain.from_iterable((expires, url) for url in urls)),
+            ('ZREMRANGEBYRANK', key, 0, -capacity - 1),
+            # Ключ живет чуть дольше своих ссылок: просроченные выбрасывает и считает pool_get
+            ('EXPIRE', key, int(ttl) + 1)
+        )
+    
+    async def pool_clear(self):
+        await self.redis.execute('DEL', *(self.key('feed', category) for category in CATEGORIES))
+    
+    async def get_cookies(self) -> Optional[Dict]:
+        raw = await self.redis.execute('GET', self.key('cookies'))
+        return json.loads(raw) if raw else None
+    
+    async def set_cookies(self, cookies: Dict):
+        await self.redis.execute('SET', self.key('cookies'), json.dumps(cookies, ensure_ascii=False))
+    
+    def memory_report(self) -> str:
+        return f"состояние в Redis {self.redis.host}:{self.redis.port}"
+    
+    def seen_stats(self) -> Dict[str, int]:
+        # Фильтры лежат в Redis, их размер виден в метриках самого Redis
+        return {}
+    
+    def save(self):
+        pass
+    
+    def snapshot(self) -> Dict:
+        # Диалоги и буфер ленты и так переживают перезапуск в Redis
+        return {}
+    
+    def restore(self, data: Dict):
+        pass
+    
+    async def close(self):
+        await self.redis.close()
+
+
+def create_state():
+    """Общее состояние в Redis, если задан REDIS_URL, иначе — в памяти процесса"""
+    if REDIS_URL:
+        return RedisState(REDIS_URL)
+    return MemoryState()
+
+
+class SingleFlight:
+    """Склейка одинаковых одновременных запросов.
+    
+    Пока запрос с ключом key выполняется, остальные вызовы с тем же ключом
+    ждут его результат вместо повторного запроса.
+    """
+    
+    def __init__(self):
+        self.calls: Dict[Hashable, asyncio.Future] = {}
+        self.stats = {'calls': 0, 'shared': 0}
+    
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        future = self.calls.get(key)
+        if future is None:
+            self.stats['calls'] += 1
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        else:
+            self.stats['shared'] += 1
+        # shield: отмена одного ожидающего не отменяет запрос для остальных
+        return await asyncio.shield(future)
+    
+    def _done(self, key: Hashable, future: asyncio.Future):
+        if self.calls.get(key) is future:
+            del self.calls[key]
+        if not future.cancelled():
+            future.exception()  # помечаем ошибку полученной, даже если ждать было некому
+
+
+class CircuitBreaker:
+    """Предохранитель для внешнего сервиса.
+    
+    После failures сбоев подряд размыкается и reset секунд сразу отказывает,
+    затем пропускает один пробный запрос: удачный замыкает цепь, неудачный
+    снова размыкает. Переходы считаются в stats.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    
+    def __init__(self, name: str, failures: int = BREAKER_FAILURES, reset: float = BREAKER_RESET):
+        self.name = name
+        self.max_failures = failures
+        self.reset = reset
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.stats = {'opened': 0, 'half_opened': 0, 'closed': 0, 'rejected': 0}
+    
+    def allow(self) -> bool:
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset:
+                self.stats['rejected'] += 1
+                return False
+            self._switch(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.probing:
+                self.stats['rejected'] += 1
+                return False
+            self.probing = True
+        return True
+    
+    def success(self):
+        self.failures = 0
+        self.probing = False
+        if self.state != self.CLOSED:
+            self._switch(self.CLOSED)
+    
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.max_failures):
+            self.opened_at = time.monotonic()
+            self._switch(self.OPEN)
+    
+    def cancel(self):
+        """Запрос отменен, не дойдя до ответа: пробу можно повторить"""
+        self.probing = False
+    
+    def _switch(self, state: str):
+        self.state = state
+        self.stats[{'open': 'opened', 'half_open': 'half_opened', 'closed': 'closed'}[state]] += 1
+        logger.warning(f"Предохранитель {self.name}: {state} (сбоев подряд: {self.failures})")
+
+
+def cookie_fingerprint(cookies: Dict) -> str:
+    """Короткий отпечаток кук — имя аккаунта в пуле"""
+    raw = json.dumps(cookies or {}, sort_keys=True)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:12]
+
+
+def normalize_cookie_pool(data) -> Dict[str, Dict]:
+    """Пул {имя: куки}; старый формат (один словарь кук) становится пулом из одного аккаунта"""
+    if not isinstance(data, dict) or not data:
+        return {}
+    if all(isinstance(value, dict) for value in data.values()):
+        return data
+    return {cookie_fingerprint(data): data}
+
+
+class CookieIdentity:
+    """Аккаунт Pinterest: куки, свой лимит запросов и здоровье"""
+    
+    def __init__(self, name: str, cookies: Dict):
+        self.name = name
+        self.cookies = cookies
+        self.bucket = TokenBucket(IDENTITY_RATE, IDENTITY_BURST)
+        self.in_flight = 0
+        self.failures = 0            # отказов подряд
+        self.resting_until = 0.0     # до этого момента (monotonic) аккаунт не трогаем
+        self.quarantined = False
+        self.stats = {'requests': 0, 'throttled': 0, 'errors': 0}
+    
+    def available(self, now: float) -> bool:
+        return self.resting_until <= now
+
+
+class CookiePool:
+    """Пул аккаунтов Pinterest.
+    
+    Запрос уходит наименее загруженному аккаунту. На 429/403 аккаунт
+    отдыхает с экспоненциально растущей паузой, после
+    IDENTITY_QUARANTINE_AFTER отказов подряд — уходит в карантин на
+    IDENTITY_QUARANTINE_TIME, а затем получает еще одну попытку.
+    """
+    
+    def __init__(self):
+        self.identities: Dict[str, CookieIdentity] = {}
+    
+    def __len__(self) -> int:
+        return len(self.identities)
+    
+    def add(self, name: str, cookies: Dict) -> CookieIdentity:
+        identity = self.identities.get(name)
+        if identity is None:
+            identity = self.identities[name] = CookieIdentity(name, cookies)
+        else:
+            identity.cookies = cookies
+        return identity
+    
+    def replace(self, pool: Dict[str, Dict]):
+        """Приводит пул к списку аккаунтов, сохраняя здоровье уже известных"""
+        for name in list(self.identities):
+            if name not in pool:
+                del self.identities[name]
+        for name, cookies in pool.items():
+            self.add(name, cookies)
+    
+    def export(self) -> Dict[str, Dict]:
+        return {name: identity.cookies for name, identity in self.identities.items()}
+    
+    def pick(self) -> Optional[CookieIdentity]:
+        """Свободный аккаунт с наименьшей нагрузкой или None, если все отдыхают"""
+        now = time.monotonic()
+        ready = [identity for identity in self.identities.values() if identity.available(now)]
+        if not ready:
+            return None
+        return min(ready, key=lambda identity: (identity.in_flight, identity.bucket.reserve(0),
+                                                identity.stats['requests']))
+    
+    async def acquire(self, identity: CookieIdentity):
+        identity.in_flight += 1
+        identity.stats['requests'] += 1
+        await identity.bucket.acquire()
+    
+    def cancel(self, identity: CookieIdentity):
+        """Запрос не состоялся: освобождаем слот, здоровье аккаунта не трогаем"""
+        identity.in_flight -= 1
+    
+    def release(self, identity: CookieIdentity, status: Optional[int]):
+        """Учитывает ответ Pinterest (None — сетевая ошибка)"""
+        identity.in_flight -= 1
+        if status is not None and status < 400:
+            identity.failures = 0
+            identity.quarantined = False
+            return
+        if status not in (401, 403, 429):
+            # Сбой сети или самого Pinterest — аккаунт тут ни при чем
+            identity.stats['errors'] += 1
+            return
+        
+        identity.stats['throttled'] += 1
+        identity.failures += 1
+        if identity.failures >= IDENTITY_QUARANTINE_AFTER:
+            identity.quarantined = True
+            pause = IDENTITY_QUARANTINE_TIME
+            logger.warning(f"Аккаунт {identity.name} в карантине: {identity.failures} отказов подряд")
+        else:
+            pause = min(IDENTITY_BACKOFF_MAX, IDENTITY_BACKOFF_BASE * 2 ** (identity.failures - 1))
+            # Разброс, чтобы аккаунты, отказавшие одновременно, не возвращались разом
+            pause *= random.uniform(0.5, 1)
+            logger.warning(f"Аккаунт {identity.name}: ответ {status}, пауза {pause:.0f} с")
+        identity.resting_until = time.monotonic() + pause
+    
+    def snapshot(self) -> Dict[str, Tuple[int, bool, float]]:
+        """Здоровье аккаунтов: отказы подряд, карантин и конец паузы по часам (не monotonic)"""
+        offset = time.time() - time.monotonic()
+        return {name: (identity.failures, identity.quarantined, identity.resting_until + offset)
+                for name, identity in self.identities.items() if identity.failures}
+    
+    def restore(self, data: Dict[str, Tuple[int, bool, float]]):
+        offset = time.time() - time.monotonic()
+        for name, (failures, quarantined, resting_until) in data.items():
+            identity = self.identities.get(name)
+            if identity is not None:
+                identity.failures = failures
+                identity.quarantined = quarantined
+                identity.resting_until = max(0.0, resting_until - offset)
+    
+    def state_counts(self) -> Dict[str, int]:
+        now = time.monotonic()
+        counts = {'ok': 0, 'resting': 0, 'quarantined': 0}
+        for identity in self.identities.values():
+            if identity.quarantined:
+                counts['quarantined'] += 1
+            elif not identity.available(now):
+                counts['resting'] += 1
+            else:
+                counts['ok'] += 1
+        return counts
+    
+    def report(self) -> str:
+        now = time.monotonic()
+        parts = []
+        for identity in self.identities.values():
+            status = 'карантин' if identity.quarantined else 'пауза' if not identity.available(now) else 'ок'
+            parts.append(f"{identity.name} ({status}, {identity.stats})")
+        return ', '.join(parts) or 'пусто'
+
+
+class HammingIndex:
+    """64-битные хеши с поиском ближайшего на расстоянии Хэмминга до distance.
+    
+    Multi-index hashing: хеш режется на distance + 1 кусков, и у хешей,
+    отличающихся не больше чем на distance бит, хотя бы один кусок совпадает
+    целиком. Кандидатов берем по точному совпадению кусков, расстояние
+    считаем только для них. Сверх capacity вытесняются самые старые хеши.
+    """
+    
+    def __init__(self, distance: int = PHASH_DISTANCE, capacity: int = PHASH_INDEX):
+        self.distance = distance
+        self.capacity = capacity
+        chunks = distance + 1
+        self.spans: List[Tuple[int, int]] = []  # (сдвиг, маска) каждого куска
+        shift = 0
+        for i in range(chunks):
+            bits = 64 // chunks + (i < 64 % chunks)
+            self.spans.append((shift, (1 << bits) - 1))
+            shift += bits
+        self.tables: List[Dict[int, set]] = [{} for _ in self.spans]
+        self.groups: OrderedDict = OrderedDict()  # хеш -> группа, от старых к новым
+    
+    def __len__(self) -> int:
+        return len(self.groups)
+    
+    def nearest(self, value: int) -> Optional[int]:
+        """Группа ближайшего хеша не дальше distance бит или None"""
+        if value in self.groups:
+            return self.groups[value]
+        best, best_distance = None, self.distance + 1
+        for (shift, mask), table in zip(self.spans, self.tables):
+            for other in table.get((value >> shift) & mask, ()):
+                distance = (value ^ other).bit_count()
+                if distance < best_distance:
+                    best, best_distance = other, distance
+        return None if best is None else self.groups[best]
+    
+    def add(self, value: int, group: int):
+        if value in self.groups:
+            self.groups.move_to_end(value)
+            return
+        self.groups[value] = group
+        for (shift, mask), table in zip(self.spans, self.tables):
+            table.setdefault((value >> shift) & mask, set()).add(value)
+        while len(self.groups) > self.capacity:
+            old, _ = self.groups.popitem(last=False)
+            for (shift, mask), table in zip(self.spans, self.tables):
+                key = (old >> shift) & mask
+                bucket = table[key]
+                bucket.discard(old)
+                if not bucket:
+                    del table[key]
+
+
+class ImageHashes:
+    """Перцептивные хеши картинок и группы похожих.
+    
+    Картинка попадает в группу ближайшего известного хеша (не дальше
+    PHASH_DISTANCE бит) или открывает свою. Фильтр просмотренных помечает
+    группу целиком, поэтому репост той же работы под другой ссылкой или в
+    другом размере пользователь второй раз не увидит.
+    """
+    
+    MAGIC = b'PHASH1'
+    RECORD = struct.Struct('<QQH')  # хеш, группа, длина url
+    
+    def __init__(self, path: str, capacity: int = PHASH_CACHE):
+        self.path = path
+        self.urls = LRUCache(capacity)  # url -> (хеш, группа)
+        self.index = HammingIndex()
+        self.enabled = PHASH_DEDUP and HAS_PIL
+        self.dirty = False
+        self.stats = {'hashed': 0, 'grouped': 0, 'failed': 0}
+        if PHASH_DEDUP and not HAS_PIL:
+            logger.warning("Pillow не установлен: похожие картинки не отсеиваются")
+        if self.enabled:
+            self.load()
+    
+    def group(self, url: str) -> Optional[int]:
+        entry = self.urls.get(url)
+        return entry[1] if entry else None
+    
+    def seen_key(self, url: str) -> Optional[str]:
+        """Ключ группы для фильтра просмотренных (None, если хеша нет)"""
+        group = self.group(url)
+        return None if group is None else f'phash:{group:016x}'
+    
+    def add(self, url: str, value: int) -> int:
+        group = self.index.nearest(value)
+        if group is None:
+            group = value
+        else:
+            self.stats['grouped'] += 1
+        self.stats['hashed'] += 1
+        self.index.add(value, group)
+        self.urls.put(url, (value, group))
+        self.dirty = True
+        return group
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if not data.startswith(self.MAGIC):
+                raise ValueError("неизвестный формат")
+            pos = len(self.MAGIC)
+            (count,) = struct.unpack_from('<I', data, pos)
+            pos += 4
+            # Записи идут от давних к свежим — порядок LRU восстанавливается как был
+            for _ in range(count):
+                value, group, length = self.RECORD.unpack_from(data, pos)
+                pos += self.RECORD.size
+                url = data[pos:pos + length].decode('utf-8')
+                pos += length
+                self.urls.put(url, (value, group))
+                self.index.add(value, group)
+            logger.info(f"✅ Хеши картинок загружены: {count}")
+        except Exception as e:
+            logger.error(f"Не удалось загрузить {self.path}: {e}")
+    
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(struct.pack('<I', len(self.urls)))
+            for url, (value, group) in self.urls.items.items():
+                name = url.encode('utf-8')
+                f.write(self.RECORD.pack(value, group, len(name)))
+                f.write(name)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class FeedCache:
+    """Буфер заранее собранных ссылок по категориям.
+    
+    Ссылки общие для всех пользователей (фильтр просмотренных применяется
+    поверх), живут FEED_TTL секунд, размер пула ограничен. Сами пулы лежат
+    в общем состоянии, поэтому собранное одной копией бота видят все.
+    """
+    
+    def __init__(self, fetcher: Callable[[str], Awaitable[List[str]]], state=None, ttl: float = FEED_TTL,
+                 capacity: int = FEED_POOL_SIZE, low_water: int = FEED_LOW_WATER):
+        self.fetcher = fetcher
+        self.state = state or MemoryState()
+        self.ttl = ttl
+        self.capacity = capacity
+        self.low_water = low_water
+        self.refills: Dict[str, asyncio.Task] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'refills': 0, 'refill_errors': 0, 'expired': 0}
+    
+    async def get(self, category: str) -> List[str]:
+        """Текущие ссылки категории; при нехватке запускает фоновое дозаполнение"""
+        urls = await self.pool(category)
+        if len(urls) < self.low_water:
+            self.schedule_refill(category)
+        self.stats['hits' if urls else 'misses'] += 1
+        return urls
+    
+    def schedule_refill(self, category: str) -> asyncio.Task:
+        task = self.refills.get(category)
+        if task is None or task.done():
+            task = asyncio.create_task(self._refill(category))
+            self.refills[category] = task
+        return task
+    
+    async def refill(self, category: str) -> List[str]:
+        """Дозаполняет пул (или ждет уже идущее дозаполнение) и возвращает его"""
+        await asyncio.shield(self.schedule_refill(category))
+        return await self.pool(category)
+    
+    async def pool(self, category: str) -> List[str]:
+        urls = await self.state.pool_get(category)
+        # Просроченные ссылки выбрасывает само хранилище, счетчик у него же
+        self.stats['expired'] = self.state.expired
+        return urls
+    
+    async def _refill(self, category: str):
+        self.stats['refills'] += 1
+        try:
+            await self.state.pool_put(category, await self.fetcher(category), self.ttl, self.capacity)
+        except Exception as e:
+            self.stats['refill_errors'] += 1
+            logger.error(f"Ошибка обновления буфера {category}: {e}")
+    
+    async def clear(self):
+        await self.state.pool_clear()
+    
+    async def close(self):
+        for task in self.refills.values():
+            task.cancel()
+        await asyncio.gather(*self.refills.values(), return_exceptions=True)
+        self.refills.clear()
+
 
 class PinterestSession:
     """Класс для работы с Pinterest через куки (ТВОИ РЕКОМЕНДАЦИИ)"""
     
-    def __init__(self):
-        self.cookies = None
-        self.is_authenticated = False
-        self.seen_images = {}
+    def __init__(self, state=None, limit: int = HTTP_LIMIT, limit_per_host: int = HTTP_LIMIT_PER_HOST,
+                 keepalive: float = HTTP_KEEPALIVE, dns_ttl: int = HTTP_DNS_TTL, image_hashes_file: str = PHASH_FILE):
+        self.cookie_pool = CookiePool()
+        self.state = state or MemoryState()
+        self.connector_options = {
+            'limit': limit,
+            'limit_per_host': limit_per_host,
+            'keepalive_timeout': keepalive,
+            'ttl_dns_cache': dns_ttl
+        }
+        self.http: Optional[aiohttp.ClientSession] = None
+        self.stats = {'connections_new': 0, 'connections_reused': 0}
+        self.flights = SingleFlight()
+        self.bookmarks: Dict[str, str] = {}  # аккаунт -> курсор ленты
+        self.image_sizes = LRUCache(IMAGE_SIZE_CACHE)  # url -> (ширина, высота)
+        self.probe_semaphore = asyncio.Semaphore(IMAGE_PROBE_CONCURRENCY)
+        self.image_hashes = ImageHashes(image_hashes_file)
+        self.hash_semaphore = asyncio.Semaphore(PHASH_CONCURRENCY)
+        self.feed_cache = FeedCache(self.fetch_feed, self.state)
+        self.breaker = CircuitBreaker('pinterest')
+        self.timeout = aiohttp.ClientTimeout(total=PINTEREST_TOTAL_TIMEOUT, connect=PINTEREST_CONNECT_TIMEOUT,
+                                             sock_read=PINTEREST_READ_TIMEOUT)
         self.load_cookies()
     
+    @property
+    def is_authenticated(self) -> bool:
+        return len(self.cookie_pool) > 0
+    
+    async def start(self):
+        """Открывает общую HTTP-сессию (одна на весь процесс)"""
+        if self.http is not None and not self.http.closed:
+            return
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_create_end.append(self._on_connection_new)
+        trace.on_connection_reuseconn.append(self._on_connection_reused)
+        # Куки передаются в каждом запросе, общий jar не нужен
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(**self.connector_options),
+            headers=HTTP_HEADERS,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=self.timeout,
+            trace_configs=[trace]
+        )
+        logger.info("✅ HTTP-сессия Pinterest открыта")
+        
+        # Куки из общего состояния главнее локального файла; если там пусто — делимся своими
+        if not await self.sync_cookies() and self.is_authenticated:
+            await self.state.set_cookies(self.cookie_pool.export())
+        
+        if self.is_authenticated:
+            # Буфер, восстановленный из теплого снимка, заново не собираем
+            for category in CATEGORIES:
+                if len(await self.state.pool_get(category)) < self.feed_cache.low_water:
+                    self.feed_cache.schedule_refill(category)
+    
+    async def close(self):
+        await self.feed_cache.close()
+        logger.info(f"Буфер ленты: {self.feed_cache.stats}, склейка запросов: {self.flights.stats}")
+        logger.info(f"Кэш размеров картинок: {self.image_sizes.stats}")
+        logger.info(f"Хеши картинок: {self.image_hashes.stats}, хешей в индексе {len(self.image_hashes.index)}")
+        logger.info(f"Аккаунты Pinterest: {self.cookie_pool.report()}")
+        logger.info(f"Предохранитель Pinterest: {self.breaker.state}, {self.breaker.stats}")
+        logger.info(f"Состояние: {self.state.memory_report()}")
+        if self.http is not None and not self.http.closed:
+            await self.http.close()
+            logger.info(
+                f"HTTP-сессия закрыта: новых соединений {self.stats['connections_new']}, "
+                f"переиспользовано {self.stats['connections_reused']}"
+            )
+        self.http = None
+    
+    def snapshot(self) -> Dict:
+        return {
+            'image_sizes': list(self.image_sizes.items.items()),
+            'bookmarks': self.bookmarks,
+            'identities': self.cookie_pool.snapshot()
+        }
+    
+    def restore(self, data: Dict):
+        for url, size in data.get('image_sizes', ()):
+            self.image_sizes.put(url, size)
+        # Устаревший курсор не страшен: без пинов по нему лента начнется с главной страницы
+        self.bookmarks.update(data.get('bookmarks', {}))
+        self.cookie_pool.restore(data.get('identities', {}))
+    
+    async def _on_connection_new(self, session, ctx, params):
+        self.stats['connections_new'] += 1
+    
+    async def _on_connection_reused(self, session, ctx, params):
+        self.stats['connections_reused'] += 1
+    
     def load_cookies(self):
         if os.path.exists(COOKIES_FILE):
             try:
                 with open(COOKIES_FILE, 'rb') as f:
-                    self.cookies = pickle.load(f)
-                self.is_authenticated = True
-                logger.info("✅ Куки Pinterest загружены")
+                    self.cookie_pool.replace(normalize_cookie_pool(pickle.load(f)))
+                logger.info(f"✅ Куки Pinterest загружены: аккаунтов {len(self.cookie_pool)}")
                 return True
             except:
-                self.is_authenticated = False
+                pass
         return False
     
-    def save_cookies(self, cookies):
+    async def save_cookies(self, cookies) -> bool:
+        """Добавляет аккаунт в пул (повторная загрузка тех же кук ничего не меняет)"""
         try:
+            await self.sync_cookies()
+            self.cookie_pool.add(cookie_fingerprint(cookies), cookies)
+            pool = self.cookie_pool.export()
             with open(COOKIES_FILE, 'wb') as f:
-                pickle.dump(cookies, f)
-            self.cookies = cookies
-            self.is_authenticated = True
-            logger.info("✅ Куки сохранены")
+                pickle.dump(pool, f)
+            await self.state.set_cookies(pool)
+            logger.info(f"✅ Куки сохранены: аккаунтов {len(pool)}")
             return True
         except:
             return False
     
-    def check_image_format(self, url: str, category: str) -> bool:
-        """Проверка формата по URL"""
+    async def sync_cookies(self) -> bool:
+        """Подхватывает аккаунты, загруженные через другую копию бота"""
+        pool = normalize_cookie_pool(await self.state.get_cookies())
+        if pool:
+            self.cookie_pool.replace(pool)
+            return True
+        return False
+    
+    def check_image_format(self, url: str, category: str, size: Tuple[int, int] = None) -> bool:
+        """Проверка формата по размерам картинки (если размеры неизвестны — пропускаем)"""
+        size = size or self.image_sizes.get(url)
+        if not size or not size[0] or not size[1]:
+            return True
+        ratio = size[0] / size[1]
+        
         if category == "avatars":
             # Для аватарок ищем квадратные
-            if any(x in url.lower() for x in ['avatar', 'profile', 'icon', 'face']):
-                return True
-            return True  # Временно пропускаем все
+            return 1 / ASPECT_TOLERANCE <= ratio <= ASPECT_TOLERANCE
         
         elif category == "wallpapers_pc":
             # Для ПК ищем горизонтальные
-            if any(x in url.lower() for x in ['wallpaper', 'background', 'landscape']):
-                return True
-            return True
+            return ratio > ASPECT_TOLERANCE
         
         elif category == "wallpapers_phone":
             # Для телефона ищем вертикальные
-            if any(x in url.lower() for x in ['mobile', 'phone', 'vertical']):
-                return True
-            return True
+            return ratio < 1 / ASPECT_TOLERANCE
         
         return True
     
+    async def probe_image_size(self, url: str) -> Optional[Tuple[int, int]]:
+        """Размеры картинки по первым байтам файла (Range-запрос, без полной загрузки)"""
+        size = self.image_sizes.get(url)
+        if size is not None:
+            return size
+        
+        async with self.probe_semaphore:
+            try:
+                headers = {'Range': f'bytes=0-{IMAGE_PROBE_BYTES - 1}'}
+                async with self.http.get(url, headers=headers) as resp:
+                    if resp.status not in (200, 206):
+                        return None
+                    # EXIF и ICC могут отодвинуть размеры JPEG на десятки КБ — читаем, пока не найдем;
+                    # если сервер проигнорировал Range, дальше IMAGE_PROBE_BYTES все равно не идем
+                    head = await read_prefix(resp.content, IMAGE_PROBE_BYTES, image_size_from_header)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Не удалось узнать размер {url}: {e}")
+                return None
+        
+        size = image_size_from_header(head)
+        if size:
+            self.image_sizes.put(url, size)
+        return size
+    
+    async def filter_by_format(self, pins: List[Pin], category: str) -> List[str]:
+        """Ссылки пинов подходящего формата; неизвестные размеры узнаются параллельно"""
+        for pin in pins:
+            if pin.width and pin.height:
+                self.image_sizes.put(pin.url, (pin.width, pin.height))
+        
+        unknown = [pin.url for pin in pins if pin.url not in self.image_sizes]
+        if unknown:
+            # Одну и ту же картинку разные категории проверяют одним запросом
+            await asyncio.gather(*(
+                self.flights.do(('size', url), lambda url=url: self.probe_image_size(url))
+                for url in unknown
+            ))
+        return [pin.url for pin in pins if self.check_image_format(pin.url, category)]
+    
+    async def image_group(self, url: str) -> Optional[int]:
+        """Группа похожих картинок: хеш считается по миниатюре один раз и запоминается"""
+        group = self.image_hashes.group(url)
+        if group is not None:
+            return group
+        thumb = thumbnail_url(url)
+        if thumb is None:
+            return None
+        
+        async with self.hash_semaphore:
+            try:
+                async with self.http.get(thumb) as resp:
+                    if resp.status != 200:
+                        self.image_hashes.stats['failed'] += 1
+                        return None
+                    data = await read_prefix(resp.content, PHASH_MAX_BYTES)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.image_hashes.stats['failed'] += 1
+                logger.error(f"Не удалось загрузить миниатюру {thumb}: {e}")
+                return None
+        try:
+            # Декодирование JPEG — работа для процессора, не для event loop
+            value = await asyncio.get_running_loop().run_in_executor(None, dhash, data)
+        except Exception as e:
+            self.image_hashes.stats['failed'] += 1
+            logger.error(f"Не удалось посчитать хеш {thumb}: {e}")
+            return None
+        return self.image_hashes.add(url, value)
+    
+    async def drop_near_duplicates(self, urls: List[str]) -> List[str]:
+        """Оставляет по одной картинке из каждой группы похожих (хеши заодно запоминаются)"""
+        if not self.image_hashes.enabled or not urls:
+            return urls
+        groups = await asyncio.gather(*(
+            self.flights.do(('hash', url), lambda url=url: self.image_group(url))
+            for url in urls
+        ))
+        result = []
+        taken = set()
+        for url, group in zip(urls, groups):
+            if group is not None:
+                if group in taken:
+                    continue
+                taken.add(group)
+            result.append(url)
+        return result
+    
+    async def load_page(self, identity: CookieIdentity) -> List[Pin]:
+        """Следующая порция ленты аккаунта.
+        
+        Если есть курсор — берем следующую страницу через API, иначе
+        (или если API ничего не вернул) — заново главную страницу.
+        """
+        if self.http is None or self.http.closed:
+            await self.start()
+        
+        bookmark = self.bookmarks.get(identity.name)
+        pins = []
+        if bookmark and PINTEREST_MODE == 'json':
+            pins, bookmark = await self.load_resource_page(identity, bookmark)
+        if not pins:
+            pins, bookmark = await self.load_home_page(identity)
+        
+        if bookmark:
+            self.bookmarks[identity.name] = bookmark
+        else:
+            self.bookmarks.pop(identity.name, None)
+        return pins
+    
+    async def fetch(self, identity: CookieIdentity, url: str, **kwargs) -> Optional[bytes]:
+        """GET к Pinterest от имени аккаунта: тело ответа 200 или None.
+        
+        Сбои сети, таймауты и 5xx повторяются до FETCH_ATTEMPTS раз с
+        паузой decorrelated jitter; пока предохранитель разомкнут, запрос
+        не отправляется вовсе.
+        """
+        with PINTEREST_FETCH_SECONDS.time(page='resource' if PINTEREST_RESOURCE_PATH in url else 'home'):
+            return await self._fetch(identity, url, **kwargs)
+    
+    async def _fetch(self, identity: CookieIdentity, url: str, **kwargs) -> Optional[bytes]:
+        delay = FETCH_RETRY_BASE
+        for attempt in range(1, FETCH_ATTEMPTS + 1):
+            if not self.breaker.allow():
+                return None
+            status = None
+            try:
+                # Ожидание в ведре аккаунта тоже может быть отменено — поэтому внутри try
+                await self.cookie_pool.acquire(identity)
+                async with self.http.get(url, cookies=identity.cookies, **kwargs) as resp:
+                    status = resp.status
+                    body = await resp.read() if status == 200 else None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Ошибка запроса к Pinterest (попытка {attempt}): {e!r}")
+            except BaseException:
+                # Отмена (или неожиданная ошибка) — ни аккаунт, ни Pinterest тут ни при чем,
+                # но слот аккаунта и пробу предохранителя надо вернуть
+                self.cookie_pool.cancel(identity)
+                self.breaker.cancel()
+                raise
+            self.cookie_pool.release(identity, status)
+            
+            if status is not None and status < 500:
+                # 4xx — дело аккаунта, а не доступности Pinterest
+                self.breaker.success()
+                return body
+            self.breaker.failure()
+            if attempt < FETCH_ATTEMPTS:
+                delay = min(FETCH_RETRY_CAP, random.uniform(FETCH_RETRY_BASE, delay * 3))
+                await asyncio.sleep(delay)
+        return None
+    
+    async def load_home_page(self, identity: CookieIdentity) -> Tuple[List[Pin], Optional[str]]:
+        logger.info(f"Загружаю ленту аккаунта {identity.name}...")
+        body = await self.fetch(identity, PINTEREST_URL)
+        if body is None:
+            return [], None
+        # Разбор страницы в сотни КБ не должен держать event loop
+        loop = asyncio.get_running_loop()
+        with PARSE_SECONDS.time(page='home'):
+            return await loop.run_in_executor(None, parse_home_page, body.decode('utf-8', errors='replace'))
+    
+    async def load_resource_page(self, identity: CookieIdentity,
+                                 bookmark: str) -> Tuple[List[Pin], Optional[str]]:
+        logger.info(f"Загружаю следующую страницу ленты аккаунта {identity.name}...")
+        params = {
+            'source_url': '/',
+            'data': json.dumps({'options': {'bookmarks': [bookmark]}, 'context': {}}, separators=(',', ':'))
+        }
+        headers = {'Accept': 'application/json', 'X-Requested-With': 'XMLHttpRequest'}
+        body = await self.fetch(identity, PINTEREST_URL + PINTEREST_RESOURCE_PATH, params=params, headers=headers)
+        if body is None:
+            return [], None
+        try:
+            loop = asyncio.get_running_loop()
+            with PARSE_SECONDS.time(page='resource'):
+                return await loop.run_in_executor(None, parse_resource_response, body)
+        except ValueError as e:
+            logger.error(f"Ошибка разбора страницы ленты: {e}")
+            return [], None
+    
+    async def fetch_feed(self, category: str) -> List[str]:
+        """Подходящие для категории ссылки из ленты (без учета просмотренных).
+        
+        Запрос уходит наименее загруженному из здоровых аккаунтов пула;
+        одновременные загрузки ленты одного аккаунта склеиваются в один запрос.
+        """
+        await self.sync_cookies()
+        identity = self.cookie_pool.pick()
+        if identity is None:
+            logger.warning("Все аккаунты Pinterest на паузе")
+            return []
+        page = await self.flights.do(('feed', identity.name), lambda: self.load_page(identity))
+        with FORMAT_CHECK_SECONDS.time():
+            urls = await self.filter_by_format(page, category)
+        with PHASH_SECONDS.time():
+            return await self.drop_near_duplicates(urls)
+    
+    async def take_unseen(self, candidates: List[str], category: str, limit: int,
+                          user_id: str = None) -> List[str]:
+        """Отбирает непросмотренные ссылки и помечает их просмотренными"""
+        if not user_id:
+            return candidates[:limit]
+        images, marks = await self.select_unseen(candidates, category, limit, user_id)
+        await self.state.mark_seen(user_id, category, marks)
+        return images
+    
+    async def select_unseen(self, candidates: List[str], category: str, limit: int,
+                            user_id: str) -> Tuple[List[str], List[str]]:
+        """Непросмотренные ссылки без похожих на просмотренные и друг на друга — и ключи,
+        которые надо пометить просмотренными, когда картинки дойдут (сами ссылки и их группы)"""
+        # Группы похожих проверяются тем же фильтром, что и ссылки, — одним запросом
+        keys = {}
+        for url in candidates:
+            key = self.image_hashes.seen_key(url)
+            if key is not None:
+                keys[url] = key
+        seen = await self.state.seen_many(user_id, category, candidates + list(keys.values()))
+        seen_groups = {key for key, was_seen in zip(keys.values(), seen[len(candidates):]) if was_seen}
+        
+        images = []
+        near = 0
+        for url, was_seen in zip(candidates, seen):
+            if was_seen or len(images) == limit:
+                continue
+            key = keys.get(url)
+            if key in seen_groups:
+                near += 1
+                continue
+            if key is not None:
+                seen_groups.add(key)
+            images.append(url)
+        DUPLICATES_SKIPPED_TOTAL.inc(sum(seen[:len(candidates)]), category=category)
+        NEAR_DUPLICATES_SKIPPED_TOTAL.inc(near, category=category)
+        return images, images + [keys[url] for url in images if url in keys]
+    
     async def get_my_feed(self, category: str, limit: int = 10, user_id: str = None) -> List[str]:
         """ТВОИ ЛИЧНЫЕ РЕКОМЕНДАЦИИ"""
         if not self.is_authenticated:
+            FALLBACK_TOTAL.inc(category=category, reason='no_cookies')
+            return self.get_fallback_images(category, limit)
+        
+        images = []
+        reason = 'empty'
+        try:
+            # Сначала отдаем из буфера, ленту качаем только если в нем ничего нового
+            images = await self.take_unseen(await self.feed_cache.get(category), category, limit, user_id)
+            if not images:
+                # Дозаполнение продолжится в фоне, даже если ждать его дольше некогда
+                candidates = await asyncio.wait_for(self.feed_cache.refill(category), FEED_DEADLINE)
+                images = await self.take_unseen(candidates, category, limit, user_id)
+            elif len(images) < limit:
+                self.feed_cache.schedule_refill(category)
+        except asyncio.TimeoutError:
+            reason = 'timeout'
+            logger.warning(f"Лента {category} не успела загрузиться за {FEED_DEADLINE} с")
+        except Exception as e:
+            reason = 'error'
+            logger.error(f"Ошибка: {e}")
+        
+        if not images:
+            if self.breaker.state != CircuitBreaker.CLOSED and reason == 'empty':
+                reason = 'breaker'
+            FALLBACK_TOTAL.inc(category=category, reason=reason)
             return self.get_fallback_images(category, limit)
         
+        return images[:limit]
+    
+    def get_fallback_images(self, category: str, count: int) -> List[str]:
+        """Заглушки"""
         images = []
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        if category == "avatars":
+            for i in range(count):
+                images.append(f"https://api.dicebear.com/7.x/avataaars/svg?seed={random.randint(1, 10000)}")
+        elif category == "wallpapers_pc":
+            for i in range(count):
+                images.append(f"https://picsum.photos/1920/1080?random={random.randint(1, 10000)}")
+        elif category == "wallpapers_phone":
+            for i in range(count):
+                images.append(f"https://picsum.photos/1080/1920?random={random.randint(1, 10000)}")
+        return images
+
+
+_SEARCH_TOKEN = re.compile(r'[^\W_]+')
+_RU_ENDING = re.compile(r'(?:ями|ами|ого|его|ому|ему|ыми|ими|ой|ей|ий|ый|ая|яя|ое|ее|ые|ие|ов|ев|ах|ях|ам|ям|ом|ем|ую|юю|[аяоеыиуюь])$')
+_CYRILLIC = re.compile(r'[а-я]')
+
+# Что индексируем: категория -> (поле, вес)
+SEARCH_FIELDS = {
+    'notes': (('title', 3), ('content', 1)),
+    'files': (('name', 3),),
+    'videos': (('name', 3),),
+    'screenshots': (('caption', 2),),
+    'game_settings': (('name', 3), ('value', 1)),
+}
+SEARCH_LABELS = {'notes': '📝', 'files': '📁', 'videos': '🎥', 'screenshots': '📸', 'game_settings': '⚙️'}
+
+
+def search_tokens(text: str) -> List[str]:
+    """Слова текста: нижний регистр, ё -> е, подчеркивания и точки в именах файлов — разделители"""
+    return _SEARCH_TOKEN.findall(text.casefold().replace('ё', 'е'))
+
+
+def query_stem(token: str) -> str:
+    """Без окончания: «заметки» по префиксу «заметк» найдет и «заметку», и «заметкой»"""
+    if len(token) > 4 and _CYRILLIC.search(token):
+        stem = _RU_ENDING.sub('', token)
+        if len(stem) >= 3:
+            return stem
+    return token
+
+
+def item_title(category: str, item: Dict) -> str:
+    if category == 'game_settings':
+        return f"{item.get('name', '')}: {item.get('value', '')}"
+    return item.get('title') or item.get('name') or item.get('caption') or ''
+
+
+def search_weights(category: str, game: str, item: Dict) -> Dict[str, int]:
+    """Слова записи с весами полей, в которых они встретились"""
+    weights: Dict[str, int] = {}
+    for field, weight in SEARCH_FIELDS.get(category, ()):
+        for token in search_tokens(str(item.get(field) or '')):
+            weights[token] = weights.get(token, 0) + weight
+    for token in search_tokens(game):
+        weights[token] = weights.get(token, 0) + 1
+    return weights
+
+
+def rank_search(query: str, total: int, lookup: Callable[[str], Iterable[Tuple[str, Dict[int, int]]]]) -> List[int]:
+    """id записей, где есть все слова запроса (по префиксу), лучшие первыми.
+    
+    lookup(prefix) отдает пары (слово, {id: вес}) для всех слов индекса с этим
+    префиксом, total — сколько всего записей в индексе пользователя.
+    """
+    tokens = search_tokens(query)
+    if not total or not tokens:
+        return []
+    
+    scores = None
+    for token in dict.fromkeys(tokens):
+        matched: Dict[int, float] = {}
+        for term, posting in lookup(query_stem(token)):
+            # Редкие слова весят больше, точное совпадение — больше продолжения
+            weight = math.log(1 + total / len(posting)) * (1 if term == token else 0.5)
+            for item_id, tf in posting.items():
+                score = tf * weight
+                if score > matched.get(item_id, 0):
+                    matched[item_id] = score
+        if scores is None:
+            scores = matched
+        else:
+            scores = {item_id: score + matched[item_id] for item_id, score in scores.items() if item_id in matched}
+        if not scores:
+            return []
+    
+    return sorted(scores, key=lambda item_id: (-scores[item_id], -item_id))
+
+
+class SearchPartition:
+    """Инвертированный индекс записей одного пользователя для /find (журнальное хранилище).
+    
+    Слова хранятся отсортированными, поэтому все слова с нужным префиксом
+    находятся двумя bisect. Лежит файлом рядом с журналом пользователя,
+    грузится и вытесняется вместе с ним. Подпись — число записей и последний
+    id в хранилище на момент сохранения: если она разошлась с журналом
+    (падение до сохранения индекса), индекс перестраивается.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.docs: Dict[int, List] = {}                 # id -> [category, game, title, {слово: вес}]
+        self.postings: Dict[str, Dict[int, int]] = {}   # слово -> {id: вес}
+        self.terms: List[str] = []                      # слова по алфавиту
+        self.signature = [0, 0]
+        self.dirty = False
+        self.load()
+    
+    def add(self, item_id: int, category: str, game: str, item: Dict):
+        weights = search_weights(category, game, item)
+        if weights:
+            self._insert(item_id, [category, game, item_title(category, item), weights])
+            self.dirty = True
+    
+    def _insert(self, item_id: int, doc: List, sort: bool = True):
+        self.docs[item_id] = doc
+        for term, weight in doc[3].items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = {}
+                if sort:
+                    bisect.insort(self.terms, term)
+                else:
+                    self.terms.append(term)
+            posting[item_id] = weight
+    
+    def remove(self, item_id: int):
+        doc = self.docs.pop(item_id, None)
+        if doc is None:
+            return
+        for term in doc[3]:
+            posting = self.postings[term]
+            posting.pop(item_id, None)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+        self.dirty = True
+    
+    def clear(self):
+        self.docs.clear()
+        self.postings.clear()
+        self.terms.clear()
+        self.dirty = True
+    
+    def set_signature(self, signature: List[int]):
+        if self.signature != signature:
+            self.signature = signature
+            self.dirty = True
+    
+    def lookup(self, prefix: str):
+        i = bisect.bisect_left(self.terms, prefix)
+        while i < len(self.terms) and self.terms[i].startswith(prefix):
+            yield self.terms[i], self.postings[self.terms[i]]
+            i += 1
+    
+    def search(self, query: str) -> List[Tuple[int, str, str, str]]:
+        """(id, категория, игра, заголовок), см. rank_search"""
+        ranked = rank_search(query, len(self.docs), self.lookup)
+        return [(item_id, *self.docs[item_id][:3]) for item_id in ranked]
+    
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить {self.path}: {e}")
+            return
+        for item_id, category, game, title, weights in data['docs']:
+            self._insert(item_id, [category, game, title, weights], sort=False)
+        self.terms.sort()
+        self.signature = data['signature']
+    
+    def save(self):
+        if not self.dirty:
+            return
+        data = {'signature': self.signature, 'docs': [[item_id, *doc] for item_id, doc in self.docs.items()]}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class SqliteStorage:
+    """Хранилище в SQLite (WAL): одна запись — одна строка, запись не трогает остальные"""
+    
+    def __init__(self, path: str):
+        self.path = path
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS items ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            "user TEXT NOT NULL DEFAULT '', "
+            'category TEXT NOT NULL, '
+            "game TEXT NOT NULL DEFAULT '', "
+            'data TEXT NOT NULL)'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS items_lookup ON items (user, category, game, id)')
+        # Поисковый индекс: слова по (user, term) — префикс слова ищется диапазоном по первичному ключу
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS search_terms ('
+            'user TEXT NOT NULL, term TEXT NOT NULL, id INTEGER NOT NULL, weight INTEGER NOT NULL, '
+            'PRIMARY KEY (user, term, id)) WITHOUT ROWID'
+        )
+        self.db.execute('CREATE INDEX IF NOT EXISTS search_terms_item ON search_terms (user, id)')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS search_docs ('
+            'user TEXT NOT NULL, id INTEGER NOT NULL, category TEXT NOT NULL, game TEXT NOT NULL, '
+            'title TEXT NOT NULL, PRIMARY KEY (user, id)) WITHOUT ROWID'
+        )
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS search_signatures ('
+            'user TEXT PRIMARY KEY, count INTEGER NOT NULL, last INTEGER NOT NULL)'
+        )
+    
+    @contextmanager
+    def transaction(self):
+        self.db.execute('BEGIN')
+        try:
+            yield
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        self.db.execute('COMMIT')
+    
+    def is_empty(self) -> bool:
+        return self.db.execute('SELECT 1 FROM items LIMIT 1').fetchone() is None
+    
+    def add(self, category: str, item: Dict, game: str = '', user: str = '') -> int:
+        cursor = self.db.execute(
+            'INSERT INTO items (user, category, game, data) VALUES (?, ?, ?, ?)',
+            (user, category, game, json.dumps(item, ensure_ascii=False))
+        )
+        return cursor.lastrowid
+    
+    def import_items(self, records) -> int:
+        """Записи (category, item, game, user) одной транзакцией: при падении не останется половины"""
+        rows = [(user, category, game, json.dumps(item, ensure_ascii=False)) for category, item, game, user in records]
+        with self.transaction():
+            self.db.executemany('INSERT INTO items (user, category, game, data) VALUES (?, ?, ?, ?)', rows)
+        return len(rows)
+    
+    def items(self, category: str, game: str = '', user: str = '', offset: int = 0,
+              limit: int = None) -> List[Dict]:
+        rows = self.db.execute(
+            'SELECT id, data FROM items WHERE user = ? AND category = ? AND game = ? '
+            'ORDER BY id LIMIT ? OFFSET ?',
+            (user, category, game, -1 if limit is None else limit, offset)
+        )
+        return [dict(json.loads(data), id=item_id) for item_id, data in rows]
+    
+    def count(self, category: str, game: str = '', user: str = '') -> int:
+        return self.db.execute(
+            'SELECT COUNT(*) FROM items WHERE user = ? AND category = ? AND game = ?',
+            (user, category, game)
+        ).fetchone()[0]
+    
+    def delete(self, category: str, index: int, game: str = '', user: str = '') -> Optional[int]:
+        """Удаляет index-ю запись и возвращает ее id (None, если такой нет)"""
+        if index < 0:
+            return None
+        row = self.db.execute(
+            'SELECT id FROM items WHERE user = ? AND category = ? AND game = ? ORDER BY id LIMIT 1 OFFSET ?',
+            (user, category, game, index)
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute('DELETE FROM items WHERE id = ?', row)
+        return row[0]
+    
+    def user_signature(self, user: str) -> List[int]:
+        """Число записей и последний id: меняется при любом добавлении или удалении"""
+        count, last = self.db.execute('SELECT COUNT(*), MAX(id) FROM items WHERE user = ?', (user,)).fetchone()
+        return [count, last or 0]
+    
+    def user_items(self, user: str):
+        rows = self.db.execute('SELECT id, category, game, data FROM items WHERE user = ? ORDER BY id', (user,))
+        for item_id, category, game, data in rows:
+            yield item_id, category, game, json.loads(data)
+    
+    def index_signature(self, user: str) -> List[int]:
+        row = self.db.execute('SELECT count, last FROM search_signatures WHERE user = ?', (user,)).fetchone()
+        return list(row) if row else [0, 0]
+    
+    def index_update(self, user: str, signature: List[int], added=(), removed=(), reset: bool = False):
+        """Изменения поискового индекса пользователя вместе с новой подписью — одной транзакцией"""
+        added = list(added)  # user_items читает ту же базу — дочитываем до начала записи
+        with self.transaction():
+            if reset:
+                self.db.execute('DELETE FROM search_terms WHERE user = ?', (user,))
+                self.db.execute('DELETE FROM search_docs WHERE user = ?', (user,))
+            for item_id in removed:
+                self.db.execute('DELETE FROM search_terms WHERE user = ? AND id = ?', (user, item_id))
+                self.db.execute('DELETE FROM search_docs WHERE user = ? AND id = ?', (user, item_id))
+            for item_id, category, game, item in added:
+                weights = search_weights(category, game, item)
+                if not weights:
+                    continue
+                self.db.execute(
+                    'INSERT OR REPLACE INTO search_docs (user, id, category, game, title) VALUES (?, ?, ?, ?, ?)',
+                    (user, item_id, category, game, item_title(category, item))
+                )
+                self.db.executemany(
+                    'INSERT OR REPLACE INTO search_terms (user, term, id, weight) VALUES (?, ?, ?, ?)',
+                    [(user, term, item_id, weight) for term, weight in weights.items()]
+                )
+            self.db.execute(
+                'INSERT OR REPLACE INTO search_signatures (user, count, last) VALUES (?, ?, ?)',
+                (user, *signature)
+            )
+    
+    def search(self, user: str, query: str) -> List[Tuple[int, str, str, str]]:
+        """(id, категория, игра, заголовок), см. rank_search"""
+        def lookup(prefix: str):
+            postings: Dict[str, Dict[int, int]] = {}
+            rows = self.db.execute(
+                'SELECT term, id, weight FROM search_terms WHERE user = ? AND term >= ? AND term < ?',
+                (user, prefix, prefix + '\U0010ffff')
+            )
+            for term, item_id, weight in rows:
+                postings.setdefault(term, {})[item_id] = weight
+            return postings.items()
+        
+        total = self.db.execute('SELECT COUNT(*) FROM search_docs WHERE user = ?', (user,)).fetchone()[0]
+        ranked = rank_search(query, total, lookup)
+        docs = {
+            item_id: (category, game, title)
+            for item_id, category, game, title in self.db.execute(
+                'SELECT id, category, game, title FROM search_docs '
+                'WHERE user = ? AND id IN (SELECT value FROM json_each(?))',
+                (user, json.dumps(ranked))
+            )
         }
+        return [(item_id, *docs[item_id]) for item_id in ranked]
+    
+    def save_index(self):
+        pass  # индекс пишется в базу сразу
+    
+    def size_bytes(self) -> int:
+        return sum(os.path.getsize(path) for path in (self.path, self.path + '-wal') if os.path.exists(path))
+    
+    def close(self):
+        self.db.close()
+
+
+class JournalPartition:
+    """Журнал операций одного пользователя: каждая запись дописывается строкой в конец файла.
+    
+    Когда журнал разрастается, состояние сжимается в снимок (атомарно через
+    os.replace), а журнал обнуляется. Повтор журнала поверх снимка идемпотентен,
+    поэтому падение между этими шагами ничего не ломает.
+    """
+    
+    def __init__(self, path: str, compact_every: int = JOURNAL_COMPACT_OPS):
+        self.path = path
+        self.snapshot_path = path + '.snapshot'
+        self.compact_every = compact_every
+        self.next_id = 1
+        self.ops = 0
+        self.tables: Dict[Tuple[str, str], OrderedDict] = {}
+        self.index: Dict[int, Tuple[str, str]] = {}  # id -> таблица
+        self.load()
+        self.journal = open(self.path, 'a', encoding='utf-8')
+        self.search = SearchPartition(path + '.index')
+    
+    def load(self):
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            self.next_id = snapshot['next_id']
+            for item_id, category, game, item in snapshot['items']:
+                self._add(item_id, (category, game), item)
         
+        if os.path.exists(self.path):
+            with open(self.path, 'rb+') as f:
+                valid = 0
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except ValueError:
+                        # Недописанная при падении строка — отрезаем, чтобы новые записи не склеились с ней
+                        f.truncate(valid)
+                        break
+                    valid += len(line)
+                    self._apply(op)
+                    self.ops += 1
+    
+    def _add(self, item_id: int, key: Tuple[str, str], item: Dict):
+        self.tables.setdefault(key, OrderedDict())[item_id] = item
+        self.index[item_id] = key
+        self.next_id = max(self.next_id, item_id + 1)
+    
+    def _apply(self, op: Dict):
+        if op['op'] == 'add':
+            self._add(op['id'], (op['category'], op['game']), op['item'])
+        elif op['op'] == 'del':
+            key = self.index.pop(op['id'], None)
+            if key is not None:
+                self.tables[key].pop(op['id'], None)
+    
+    def _write(self, op: Dict):
+        self.journal.write(json.dumps(op, ensure_ascii=False) + '\n')
+        self.journal.flush()
+        self._apply(op)
+        self.ops += 1
+        if self.ops >= self.compact_every:
+            self.compact()
+    
+    def compact(self):
+        items = [
+            [item_id, key[0], key[1], item]
+            for key, table in self.tables.items() for item_id, item in table.items()
+        ]
+        tmp = self.snapshot_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'next_id': self.next_id, 'items': items}, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.snapshot_path)
+        self.journal.close()
+        self.journal = open(self.path, 'w', encoding='utf-8')
+        self.ops = 0
+    
+    def add(self, category: str, item: Dict, game: str = '') -> int:
+        item_id = self.next_id
+        self._write({'op': 'add', 'id': item_id, 'category': category, 'game': game, 'item': item})
+        return item_id
+    
+    def table(self, category: str, game: str = '') -> OrderedDict:
+        return self.tables.get((category, game), OrderedDict())
+    
+    def delete(self, category: str, index: int, game: str = '') -> Optional[int]:
+        table = self.table(category, game)
+        if not 0 <= index < len(table):
+            return None
+        item_id = next(itertools.islice(table, index, None))
+        self._write({'op': 'del', 'id': item_id})
+        return item_id
+    
+    def close(self):
+        self.journal.close()
+        self.search.save()
+
+
+class JournalStorage:
+    """Журналы по файлу на пользователя; в памяти держим только недавно активных"""
+    
+    def __init__(self, path: str, compact_every: int = JOURNAL_COMPACT_OPS,
+                 max_loaded: int = JOURNAL_LOADED_USERS):
+        self.path = path
+        self.compact_every = compact_every
+        self.max_loaded = max_loaded
+        self.partitions: OrderedDict = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+    
+    def partition(self, user: str) -> JournalPartition:
+        part = self.partitions.get(user)
+        if part is None:
+            name = re.sub(r'[^\w-]', '_', user) or '_'
+            part = JournalPartition(os.path.join(self.path, name + '.journal'), self.compact_every)
+            self.partitions[user] = part
+            while len(self.partitions) > self.max_loaded:
+                self.partitions.popitem(last=False)[1].close()
+        self.partitions.move_to_end(user)
+        return part
+    
+    def is_empty(self) -> bool:
+        return not os.listdir(self.path)
+    
+    def add(self, category: str, item: Dict, game: str = '', user: str = '') -> int:
+        return self.partition(user).add(category, item, game)
+    
+    def import_items(self, records) -> int:
+        """Записи (category, item, game, user) собираются в соседнем каталоге и подменяют пустой
+        каталог хранилища одним os.replace: при падении не останется половины"""
+        tmp = self.path + '.import'
+        shutil.rmtree(tmp, ignore_errors=True)
+        staging = JournalStorage(tmp, self.compact_every, self.max_loaded)
+        count = 0
         try:
-            async with aiohttp.ClientSession(headers=headers, cookies=self.cookies) as session:
-                url = 'https://ru.pinterest.com/'
-                logger.info("Загружаю твою личную ленту...")
-                
-                async with session.get(url) as resp:
-                    if resp.status == 200:
-                        html = await resp.text()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        
-                        for img in soup.find_all('img', {'src': True}):
-                            if len(images) >= limit:
-                                break
-                            
-                            src = img.get('src', '')
-                            if 'pinimg.com' in src and '236x' in src:
-                                # Берем максимальное качество
-                                high_res = src.replace('236x', '736x')
-                                
-                                # Проверка на дубликаты
-                                if user_id and high_res in self.seen_images.get(user_id, {}).get(category, set()):
-                                    continue
-                                
-                                # Проверка формата
-                                if self.check_image_format(high_res, category):
-                                    images.append(high_res)
-                                    
-                                    if user_id:
-                                        if user_id not in self.seen_images:
-                                            self.seen_images[user_id] = {}
-                                        if category not in self.seen_images[user_id]:
-                                            self.seen_images[user_id][category] = set()
-                                        self.seen_images[user_id][category].add(high_res)
-        except Exception as e:
-            logger.error(f"Ошибка: {e}")
-        
-        if not images:
-            return self.get_fallback_images(category, limit)
-        
-        return images[:limit]
+            for category, item, game, user in records:
+                staging.add(category, item, game, user)
+                count += 1
+            for part in staging.partitions.values():
+                part.compact()
+        finally:
+            staging.close()
+        self.close()
+        os.replace(tmp, self.path)
+        return count
     
-    def get_fallback_images(self, category: str, count: int) -> List[str]:
-        """Заглушки"""
-        images = []
-        if category == "avatars":
-            for i in range(count):
-                images.append(f"https://api.dicebear.com/7.x/avataaars/svg?seed={random.randint(1, 10000)}")
-        elif category == "wallpapers_pc":
-            for i in range(count):
-                images.append(f"https://picsum.photos/1920/1080?random={random.randint(1, 10000)}")
-        elif category == "wallpapers_phone":
-            for i in range(count):
-                images.append(f"https://picsum.photos/1080/1920?random={random.randint(1, 10000)}")
-        return images
+    def items(self, category: str, game: str = '', user: str = '', offset: int = 0,
+              limit: int = None) -> List[Dict]:
+        table = self.partition(user).table(category, game)
+        stop = None if limit is None else offset + limit
+        return [dict(item, id=item_id) for item_id, item in itertools.islice(table.items(), offset, stop)]
+    
+    def count(self, category: str, game: str = '', user: str = '') -> int:
+        return len(self.partition(user).table(category, game))
+    
+    def delete(self, category: str, index: int, game: str = '', user: str = '') -> Optional[int]:
+        return self.partition(user).delete(category, index, game)
+    
+    def user_signature(self, user: str) -> List[int]:
+        part = self.partition(user)
+        return [len(part.index), part.next_id - 1]
+    
+    def user_items(self, user: str):
+        for (category, game), table in self.partition(user).tables.items():
+            for item_id, item in table.items():
+                yield item_id, category, game, item
+    
+    def index_signature(self, user: str) -> List[int]:
+        return self.partition(user).search.signature
+    
+    def index_update(self, user: str, signature: List[int], added=(), removed=(), reset: bool = False):
+        index = self.partition(user).search
+        if reset:
+            index.clear()
+        for item_id in removed:
+            index.remove(item_id)
+        for item_id, category, game, item in added:
+            index.add(item_id, category, game, item)
+        index.set_signature(signature)
+    
+    def search(self, user: str, query: str) -> List[Tuple[int, str, str, str]]:
+        return self.partition(user).search.search(query)
+    
+    def save_index(self):
+        """Индексы загруженных пользователей; вытесненные сохранились при закрытии"""
+        for part in self.partitions.values():
+            part.search.save()
+    
+    def size_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.path) if entry.is_file())
+    
+    def close(self):
+        for part in self.partitions.values():
+            part.close()
+        self.partitions.clear()
+
+
+STORAGE_BACKENDS = {
+    'sqlite': (SqliteStorage, '.sqlite3'),
+    'journal': (JournalStorage, '_journal')
+}
 
 
 class DataManager:
-    def __init__(self, data_file: str):
+    """Данные пользователей: у каждого свои файлы, заметки и настройки"""
+    
+    def __init__(self, data_file: str, backend: str = STORAGE_BACKEND):
         self.data_file = data_file
-        self.data = self.load_data()
+        storage_class, suffix = STORAGE_BACKENDS[backend]
+        self.storage = storage_class(os.path.splitext(data_file)[0] + suffix)
+        self.migrate()
     
     def load_data(self) -> Dict:
         if os.path.exists(self.data_file):
@@ -179,57 +2602,868 @@ class DataManager:
             'wallpapers_phone': []
         }
     
-    def save_data(self):
-        with open(self.data_file, 'w', encoding='utf-8') as f:
-            json.dump(self.data, f, ensure_ascii=False, indent=2)
+    def migrate(self, owner: str = None):
+        """Разовый перенос старого общего bot_data.json в хранилище (владельцу owner, по умолчанию OWNER_ID)"""
+        if not os.path.exists(self.data_file) or not self.storage.is_empty():
+            return
+        owner = LEGACY_OWNER if owner is None else owner
+        if not owner:
+            # Записи без владельца не увидит ни один пользователь — файл ждет, пока владельца зададут
+            logger.error(f"{self.data_file} не перенесен: задай OWNER_ID — Telegram id, кому отдать старые записи")
+            return
+        data = self.load_data()
+        records = []
+        for category, items in data.items():
+            if category == 'game_settings':
+                for game, settings in items.items():
+                    records.extend((category, item, game, owner) for item in settings)
+            else:
+                records.extend((category, item, '', owner) for item in items)
+        # Все или ничего: иначе после падения хранилище уже не пустое и остаток не перенесется никогда
+        count = self.storage.import_items(records)
+        os.replace(self.data_file, self.data_file + '.migrated')
+        logger.info(f"✅ Перенесено записей из {self.data_file}: {count}")
+    
+    def add_item(self, category: str, item: Dict, game: str = None, user: str = ''):
+        game = self._game(category, game)
+        with STORAGE_WRITE_SECONDS.time(op='add'):
+            item_id = self.storage.add(category, item, game, user)
+        # Подпись ведем сами: если индекс уже отставал, она все равно не сойдется и поиск его перестроит
+        count, _ = self.storage.index_signature(user)
+        self.storage.index_update(user, [count + 1, item_id], added=[(item_id, category, game, item)])
     
-    def add_item(self, category: str, item: Dict, game: str = None):
-        if game and category == 'game_settings':
-            if game not in self.data['game_settings']:
-                self.data['game_settings'][game] = []
-            self.data['game_settings'][game].append(item)
-        else:
-            if category not in self.data:
-                self.data[category] = []
-            self.data[category].append(item)
-        self.save_data()
-    
-    def get_items(self, category: str, game: str = None) -> List:
-        if game and category == 'game_settings':
-            return self.data['game_settings'].get(game, [])
-        return self.data.get(category, [])
-    
-    def delete_item(self, category: str, index: int, game: str = None) -> bool:
-        if game and category == 'game_settings':
-            if game in self.data['game_settings'] and 0 <= index < len(self.data['game_settings'][game]):
-                del self.data['game_settings'][game][index]
-                self.save_data()
-                return True
+    def get_items(self, category: str, user: str = '', offset: int = 0, limit: int = None,
+                  game: str = None) -> List:
+        return self.storage.items(category, self._game(category, game), user, offset, limit)
+    
+    def count_items(self, category: str, user: str = '', game: str = None) -> int:
+        return self.storage.count(category, self._game(category, game), user)
+    
+    def delete_item(self, category: str, index: int, game: str = None, user: str = '') -> bool:
+        with STORAGE_WRITE_SECONDS.time(op='delete'):
+            item_id = self.storage.delete(category, index, self._game(category, game), user)
+        if item_id is None:
+            return False
+        count, last = self.storage.index_signature(user)
+        if item_id == last:
+            last = self.storage.user_signature(user)[1]
+        self.storage.index_update(user, [count - 1, last], removed=[item_id])
+        return True
+    
+    def search(self, user: str, query: str) -> List[Tuple[int, str, str, str]]:
+        """Записи пользователя по словам запроса, см. rank_search"""
+        with SEARCH_SECONDS.time():
+            if not self.index_synced(user):
+                self.rebuild_index(user)
+            return self.storage.search(user, query)
+    
+    def index_synced(self, user: str) -> bool:
+        return self.storage.index_signature(user) == self.storage.user_signature(user)
+    
+    def rebuild_index(self, user: str):
+        """Индекс пользователя заново из хранилища: после падения или записи из другого процесса"""
+        self.storage.index_update(user, self.storage.user_signature(user),
+                                  added=self.storage.user_items(user), reset=True)
+    
+    def size_bytes(self) -> int:
+        return self.storage.size_bytes()
+    
+    def save(self):
+        self.storage.save_index()
+    
+    def _game(self, category: str, game: str = None) -> str:
+        return game if game and category == 'game_settings' else ''
+    
+    def close(self):
+        self.storage.close()
+
+
+class SendLimiter:
+    """Темп отправки в Telegram: общий лимит бота и отдельный лимит на каждый чат"""
+    
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 group_rate: float = TG_GROUP_RATE):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chats = LRUCache(TG_CHAT_BUCKETS)
+    
+    async def acquire(self, chat_id: int, messages: int = 1):
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            # Отрицательный id — группа или канал, у них лимит строже
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = TokenBucket(rate, TG_CHAT_BURST)
+            self.chats.put(chat_id, bucket)
+        # Альбом из N фото Telegram считает как N сообщений
+        await bucket.acquire(1)
+        await self.global_bucket.acquire(messages)
+
+
+class FileIdCache:
+    """url -> file_id фото, которые Telegram уже скачивал; переживает перезапуск"""
+    
+    def __init__(self, path: str, capacity: int = FILE_ID_CACHE):
+        self.path = path
+        self.cache = LRUCache(capacity)
+        self.dirty = False
+        self.load()
+    
+    def get(self, url: str) -> Optional[str]:
+        return self.cache.get(url)
+    
+    def remember(self, urls: List[str], messages):
+        for url, message in zip(urls, messages):
+            if message.photo:
+                self.cache.put(url, message.photo[-1].file_id)
+                self.dirty = True
+    
+    def forget(self, url: str):
+        if self.cache.pop(url) is not None:
+            self.dirty = True
+    
+    def load(self):
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    # Список пар в порядке LRU: от давних к свежим
+                    for url, file_id in json.load(f):
+                        self.cache.put(url, file_id)
+            except Exception as e:
+                logger.error(f"Не удалось загрузить {self.path}: {e}")
+    
+    def save(self):
+        if not self.dirty:
+            return
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(list(self.cache.items.items()), f, ensure_ascii=False)
+        os.replace(tmp, self.path)
+        self.dirty = False
+
+
+class WarmState:
+    """Снимок прогретого состояния: пишется при остановке, читается при старте.
+    
+    Сюда попадает то, что иначе пришлось бы заново собирать у Pinterest:
+    буфер ленты, кэш размеров картинок, курсоры и здоровье аккаунтов, а
+    также недописанные диалоги. Формат — заголовок и сжатый pickle.
+    """
+    
+    MAGIC = b'WARM1'
+    
+    def __init__(self, path: str):
+        self.path = path
+    
+    def load(self) -> Dict:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+            if not data.startswith(self.MAGIC):
+                raise ValueError("неизвестный формат")
+            snapshot = pickle.loads(zlib.decompress(data[len(self.MAGIC):]))
+            age = time.time() - snapshot.get('saved', 0)
+            logger.info(f"✅ Теплый снимок загружен: {len(data) // 1024} КБ, сделан {age:.0f} с назад")
+            return snapshot
+        except Exception as e:
+            logger.error(f"Не удалось загрузить {self.path}: {e}")
+            return {}
+    
+    def save(self, snapshot: Dict):
+        data = zlib.compress(pickle.dumps(dict(snapshot, saved=time.time()), pickle.HIGHEST_PROTOCOL), 1)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(data)
+        os.replace(tmp, self.path)
+
+
+class BroadcastStore:
+    """Подписки и ход рассылок в SQLite (одна машина; для нескольких — RedisBroadcastStore).
+    
+    Рассылка — строка в broadcasts (одна на категорию за интервал) и по
+    строке доставки на подписчика. Отправитель берет доставку через claim и
+    отмечает ее сразу после отправки, поэтому после перезапуска рассылка
+    продолжается с тех, кому еще не ушло.
+    """
+    
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(
+            'CREATE TABLE IF NOT EXISTS subscriptions ('
+            'chat_id INTEGER NOT NULL, category TEXT NOT NULL, PRIMARY KEY (chat_id, category));'
+            'CREATE INDEX IF NOT EXISTS subscriptions_category ON subscriptions (category);'
+            'CREATE TABLE IF NOT EXISTS broadcasts ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, category TEXT NOT NULL, slot INTEGER NOT NULL, '
+            'urls TEXT NOT NULL, created REAL NOT NULL, finished REAL, UNIQUE (category, slot));'
+            'CREATE TABLE IF NOT EXISTS deliveries ('
+            'broadcast_id INTEGER NOT NULL, chat_id INTEGER NOT NULL, '
+            "status TEXT NOT NULL DEFAULT 'pending', sent INTEGER NOT NULL DEFAULT 0, "
+            'PRIMARY KEY (broadcast_id, chat_id));'
+        )
+        # Взятые, но не отмеченные до падения доставки — снова в очередь: файл у процесса один
+        self.db.execute("UPDATE deliveries SET status = 'pending' WHERE status = 'claimed'")
+    
+    async def subscriptions(self, chat_id: int) -> set:
+        rows = self.db.execute('SELECT category FROM subscriptions WHERE chat_id = ?', (chat_id,))
+        return {category for category, in rows}
+    
+    async def subscribe(self, chat_id: int, category: str, on: bool = True):
+        if on:
+            self.db.execute('INSERT OR IGNORE INTO subscriptions VALUES (?, ?)', (chat_id, category))
         else:
-            if category in self.data and 0 <= index < len(self.data[category]):
-                del self.data[category][index]
-                self.save_data()
-                return True
-        return False
+            self.db.execute('DELETE FROM subscriptions WHERE chat_id = ? AND category = ?', (chat_id, category))
+    
+    async def unsubscribe_all(self, chat_id: int):
+        self.db.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+    
+    async def subscriber_count(self, category: str) -> int:
+        return self.db.execute('SELECT COUNT(*) FROM subscriptions WHERE category = ?', (category,)).fetchone()[0]
+    
+    async def has_slot(self, category: str, slot: int) -> bool:
+        return self.db.execute(
+            'SELECT 1 FROM broadcasts WHERE category = ? AND slot = ?', (category, slot)
+        ).fetchone() is not None
+    
+    async def create(self, category: str, slot: int, urls: List[str]) -> Optional[int]:
+        """Новая рассылка всем текущим подписчикам категории (None, если за этот интервал уже была)"""
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = self.db.execute(
+                'INSERT OR IGNORE INTO broadcasts (category, slot, urls, created) VALUES (?, ?, ?, ?)',
+                (category, slot, json.dumps(urls), time.time())
+            )
+            broadcast_id = cursor.lastrowid if cursor.rowcount else None
+            if broadcast_id is not None:
+                self.db.execute(
+                    'INSERT INTO deliveries (broadcast_id, chat_id) '
+                    'SELECT ?, chat_id FROM subscriptions WHERE category = ?',
+                    (broadcast_id, category)
+                )
+            self.db.execute('COMMIT')
+        except BaseException:
+            self.db.execute('ROLLBACK')
+            raise
+        return broadcast_id
+    
+    async def unfinished(self) -> List[Tuple[int, str, List[str]]]:
+        rows = self.db.execute('SELECT id, category, urls FROM broadcasts WHERE finished IS NULL ORDER BY id')
+        return [(broadcast_id, category, json.loads(urls)) for broadcast_id, category, urls in rows]
+    
+    async def claim(self, broadcast_id: int) -> Optional[int]:
+        """Следующий подписчик, которому еще не отправляли (None, если таких не осталось)"""
+        row = self.db.execute(
+            "SELECT chat_id FROM deliveries WHERE broadcast_id = ? AND status = 'pending' LIMIT 1", (broadcast_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        self.db.execute(
+            "UPDATE deliveries SET status = 'claimed' WHERE broadcast_id = ? AND chat_id = ?", (broadcast_id, *row)
+        )
+        return row[0]
+    
+    async def done(self, broadcast_id: int, chat_id: int, status: str, sent: int = 0):
+        self.db.execute(
+            'UPDATE deliveries SET status = ?, sent = ? WHERE broadcast_id = ? AND chat_id = ?',
+            (status, sent, broadcast_id, chat_id)
+        )
+    
+    async def finish(self, broadcast_id: int) -> Optional[Dict[str, int]]:
+        """Закрывает рассылку и возвращает итог: статус -> число доставок.
+        
+        None, если доставки еще идут или рассылка уже закрыта.
+        """
+        if self.db.execute(
+            "SELECT 1 FROM deliveries WHERE broadcast_id = ? AND status IN ('pending', 'claimed') LIMIT 1",
+            (broadcast_id,)
+        ).fetchone():
+            return None
+        cursor = self.db.execute(
+            'UPDATE broadcasts SET finished = ? WHERE id = ? AND finished IS NULL', (time.time(), broadcast_id)
+        )
+        if not cursor.rowcount:
+            return None
+        rows = self.db.execute(
+            'SELECT status, COUNT(*) FROM deliveries WHERE broadcast_id = ? GROUP BY status', (broadcast_id,)
+        )
+        return dict(rows.fetchall())
+    
+    def close(self):
+        self.db.close()
+
+
+class RedisBroadcastStore:
+    """Подписки и ход рассылок в общем Redis: их видят и разбирают все копии бота.
+    
+    Слот рассылки занимает одна копия (SET NX), подписчиков на момент
+    создания рассылка копирует в свое множество ожидающих. Отправители всех
+    копий забирают оттуда по одному через SMOVE во множество взятых, так что
+    каждому уходит одна доставка. Взятое, но не отмеченное за
+    DIGEST_CLAIM_TIMEOUT (копия упала посреди отправки), unfinished
+    возвращает в очередь.
+    """
+    
+    def __init__(self, state: 'RedisState', slot_ttl: int = None):
+        self.redis = state.redis
+        self.key = state.key
+        self.slot_ttl = slot_ttl or max(2 * DIGEST_INTERVAL, 60)
+    
+    async def subscriptions(self, chat_id: int) -> set:
+        return set(await self.redis.execute('SMEMBERS', self.key('subs', chat_id)))
+    
+    async def subscribe(self, chat_id: int, category: str, on: bool = True):
+        command = 'SADD' if on else 'SREM'
+        await self.redis.pipeline(
+            (command, self.key('subs', chat_id), category),
+            (command, self.key('subscribers', category), chat_id)
+        )
+    
+    async def unsubscribe_all(self, chat_id: int):
+        categories = await self.subscriptions(chat_id)
+        await self.redis.pipeline(
+            *(('SREM', self.key('subscribers', category), chat_id) for category in categories),
+            ('DEL', self.key('subs', chat_id))
+        )
+    
+    async def subscriber_count(self, category: str) -> int:
+        return await self.redis.execute('SCARD', self.key('subscribers', category))
+    
+    async def has_slot(self, category: str, slot: int) -> bool:
+        return bool(await self.redis.execute('EXISTS', self.key('bslot', category, slot)))
+    
+    async def create(self, category: str, slot: int, urls: List[str]) -> Optional[int]:
+        """Новая рассылка всем текущим подписчикам категории (None, если слот уже заняла другая копия)"""
+        broadcast_id = await self.redis.execute('INCR', self.key('bnext'))
+        if await self.redis.execute('SET', self.key('bslot', category, slot), broadcast_id,
+                                    'NX', 'EX', self.slot_ttl) is None:
+            return None
+        await self.redis.pipeline(
+            ('MULTI',),
+            ('HSET', self.key('bcast', broadcast_id), 'category', category, 'urls', json.dumps(urls),
+             'created', time.time()),
+            ('SUNIONSTORE', self.key('bpending', broadcast_id), self.key('subscribers', category)),
+            ('ZADD', self.key('bopen'), broadcast_id, broadcast_id),
+            ('EXEC',)
+        )
+        return broadcast_id
+    
+    async def unfinished(self) -> List[Tuple[int, str, List[str]]]:
+        result = []
+        for broadcast_id in await self.redis.execute('ZRANGE', self.key('bopen'), 0, -1):
+            broadcast_id = int(broadcast_id)
+            await self._requeue_stale(broadcast_id)
+            category, urls = await self.redis.execute('HMGET', self.key('bcast', broadcast_id), 'category', 'urls')
+            if category is not None:
+                result.append((broadcast_id, category, json.loads(urls)))
+        return result
+    
+    async def _requeue_stale(self, broadcast_id: int):
+        claimed, times = self.key('bclaimed', broadcast_id), self.key('bclaimtime', broadcast_id)
+        chats = await self.redis.execute('SMEMBERS', claimed)
+        if not chats:
+            return
+        deadline = time.time() - DIGEST_CLAIM_TIMEOUT
+        stale = [
+            chat for chat, taken in zip(chats, await self.redis.execute('HMGET', times, *chats))
+            if taken is None or float(taken) < deadline
+        ]
+        for chat in stale:
+            await self.redis.pipeline(
+                ('SMOVE', claimed, self.key('bpending', broadcast_id), chat),
+                ('HDEL', times, chat)
+            )
+    
+    async def claim(self, broadcast_id: int) -> Optional[int]:
+        """Следующий подписчик, которому еще не отправляли (None, если таких не осталось)"""
+        pending, claimed = self.key('bpending', broadcast_id), self.key('bclaimed', broadcast_id)
+        while True:
+            chat = await self.redis.execute('SRANDMEMBER', pending)
+            if chat is None:
+                return None
+            # SMOVE атомарен: если подписчика уже забрала другая копия, пробуем следующего
+            if await self.redis.execute('SMOVE', pending, claimed, chat):
+                await self.redis.execute('HSET', self.key('bclaimtime', broadcast_id), chat, time.time())
+                return int(chat)
+    
+    async def done(self, broadcast_id: int, chat_id: int, status: str, sent: int = 0):
+        await self.redis.pipeline(
+            ('HSET', self.key('bstatus', broadcast_id), chat_id, status),
+            ('SREM', self.key('bclaimed', broadcast_id), chat_id),
+            ('HDEL', self.key('bclaimtime', broadcast_id), chat_id)
+        )
+    
+    async def finish(self, broadcast_id: int) -> Optional[Dict[str, int]]:
+        """Закрывает рассылку и возвращает итог: статус -> число доставок.
+        
+        None, если доставки еще идут (их закроет копия, отправившая последнюю)
+        или рассылку уже закрыла другая копия.
+        """
+        pending, claimed = await self.redis.pipeline(
+            ('SCARD', self.key('bpending', broadcast_id)),
+            ('SCARD', self.key('bclaimed', broadcast_id))
+        )
+        if pending or claimed:
+            return None
+        status = self.key('bstatus', broadcast_id)
+        removed, _, statuses, *_ = await self.redis.pipeline(
+            ('ZREM', self.key('bopen'), broadcast_id),
+            ('HSET', self.key('bcast', broadcast_id), 'finished', time.time()),
+            ('HVALS', status),
+            # Законченная рассылка нужна только для разбора, потом Redis ее забывает
+            ('EXPIRE', self.key('bcast', broadcast_id), DIGEST_KEEP),
+            ('EXPIRE', status, DIGEST_KEEP)
+        )
+        if not removed:
+            return None
+        summary: Dict[str, int] = {}
+        for value in statuses:
+            summary[value] = summary.get(value, 0) + 1
+        return summary
+    
+    def close(self):
+        pass  # соединения принадлежат RedisState
+
+
+def create_broadcasts(state):
+    """Подписки и рассылки там же, где общее состояние: в Redis, если оно там, иначе в SQLite"""
+    if isinstance(state, RedisState):
+        return RedisBroadcastStore(state)
+    return BroadcastStore(BROADCAST_FILE)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Апдейты разных пользователей обрабатываются параллельно, одного пользователя — по порядку.
+    
+    Слот воркера апдейт берет только после очереди своего пользователя,
+    поэтому ждущие за медленным пользователем апдейты слоты не занимают.
+    Семафор базового класса лишь ограничивает, сколько апдейтов может
+    ждать (UPDATE_BACKLOG).
+    
+    Повторное нажатие кнопки ленты, пока предыдущее еще не отработало,
+    не ставится в очередь, а сразу отвечает «уже загружаю».
+    """
+    
+    def __init__(self, max_concurrent_updates: int, backlog: int = UPDATE_BACKLOG):
+        super().__init__(max(backlog, max_concurrent_updates))
+        self.workers = asyncio.Semaphore(max_concurrent_updates)
+        self.locks: Dict[int, asyncio.Lock] = {}
+        self.pending: Dict[int, int] = {}
+        self.feeds_in_flight = set()  # (пользователь, callback_data)
+    
+    @staticmethod
+    def ordering_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self.workers:
+                await coroutine
+            return
+        
+        feed = None
+        query = update.callback_query
+        if query is not None and query.data in FEED_CALLBACKS:
+            feed = (key, query.data)
+            if feed in self.feeds_in_flight:
+                coroutine.close()
+                try:
+                    await query.answer("⏳ Уже загружаю...")
+                except TelegramError:
+                    pass
+                return
+            self.feeds_in_flight.add(feed)
+        
+        lock = self.locks.setdefault(key, asyncio.Lock())
+        self.pending[key] = self.pending.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self.workers:
+                    await coroutine
+        finally:
+            self.pending[key] -= 1
+            if not self.pending[key]:
+                del self.pending[key]
+                del self.locks[key]
+            if feed is not None:
+                self.feeds_in_flight.discard(feed)
+    
+    async def initialize(self):
+        pass
+    
+    async def shutdown(self):
+        pass
+
+
+class WebhookServer:
+    """Встроенный HTTP-сервер: принимает апдейты от Telegram и отвечает на проверки здоровья"""
+    
+    def __init__(self, application: Application, path: str, secret: str):
+        self.application = application
+        self.secret = secret
+        self.ready = False
+        self.runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle_update)
+        self.app.router.add_get('/healthz', self.health)
+        self.app.router.add_get('/readyz', self.readiness)
+    
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        # Байты, а не строки: compare_digest не принимает строки с не-ASCII символами
+        if not hmac.compare_digest(token.encode('utf-8', 'surrogatepass'), self.secret.encode()):
+            return web.Response(status=403)
+        if not self.ready:
+            # Telegram повторит доставку — возможно, уже на другую копию
+            return web.Response(status=503)
+        try:
+            data = await request.json()
+            # Кривое тело — ошибка клиента (400), а не сервера: до очереди оно не доходит
+            if not isinstance(data, dict) or not data:
+                return web.Response(status=400)
+            update = Update.de_json(data, self.application.bot)
+        except (ValueError, TypeError, AttributeError):
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+    
+    async def health(self, request: web.Request) -> web.Response:
+        return web.Response(text='ok')
+    
+    async def readiness(self, request: web.Request) -> web.Response:
+        if self.ready and self.application.running:
+            return web.Response(text='ready')
+        return web.Response(status=503, text='not ready')
+    
+    async def start(self, host: str, port: int):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        # Несколько процессов-воркеров слушают один порт, ядро делит между ними соединения
+        await web.TCPSite(self.runner, host, port, reuse_port=WEBHOOK_WORKERS > 1).start()
+    
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с /metrics для Prometheus"""
+    
+    def __init__(self, registry: MetricsRegistry = METRICS):
+        self.registry = registry
+        self.runner: Optional[web.AppRunner] = None
+        self.app = web.Application()
+        self.app.router.add_get('/metrics', self.metrics)
+    
+    async def metrics(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+    
+    async def start(self, host: str, port: int):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, host, port).start()
+            logger.info(f"✅ Метрики: http://{host}:{port}/metrics")
+        except OSError as e:
+            # Без метрик бот работать может, поэтому не падаем
+            logger.error(f"Не удалось открыть порт метрик {port}: {e}")
+            await self.stop()
+    
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+def worker_path(path: str, worker: int) -> str:
+    """Свой файл кэша у каждого воркера на машине: у воркера 0 — path, у воркера i — name.i.ext"""
+    if not worker:
+        return path
+    root, ext = os.path.splitext(path)
+    return f'{root}.{worker}{ext}'
 
 
 class TelegramBot:
-    def __init__(self, token: str):
+    def __init__(self, token: str, worker: int = 0):
+        STARTUP.mark('импорт модулей')
         self.token = token
+        self.worker = worker
         self.data_manager = DataManager(DATA_FILE)
-        self.pinterest = PinterestSession()
+        STARTUP.mark('данные пользователей')
+        self.state = create_state()
+        STARTUP.mark('состояние и просмотренные')
+        self.pinterest = PinterestSession(self.state, image_hashes_file=worker_path(PHASH_FILE, worker))
+        STARTUP.mark('куки и хеши картинок')
+        self.send_limiter = SendLimiter()
+        self.file_ids = FileIdCache(worker_path(FILE_IDS_FILE, worker))
+        STARTUP.mark('кэш file_id')
+        self.maintenance_task: Optional[asyncio.Task] = None
+        self.broadcasts = create_broadcasts(self.state)
+        self.digest_bucket = TokenBucket(DIGEST_RATE, DIGEST_RATE)
+        self.digest_task: Optional[asyncio.Task] = None
+        STARTUP.mark('рассылки')
+        self.warm_state = WarmState(worker_path(WARM_STATE_FILE, worker))
+        self.restore_warm_state()
+        STARTUP.mark('теплый снимок')
+        self.metrics_server = MetricsServer()
+        self.metrics_port = METRICS_PORT + worker if METRICS_PORT else 0
+        self.register_metrics()
         
-        self.application = Application.builder().token(token).build()
+        self.application = (
+            Application.builder()
+            .token(token)
+            .base_url(TELEGRAM_API_URL)
+            .concurrent_updates(PerUserUpdateProcessor(UPDATE_WORKERS))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         self.setup_handlers()
+        STARTUP.mark('приложение Telegram')
+    
+    async def post_init(self, application: Application):
+        STARTUP.mark('подключение к Telegram')
+        await self.pinterest.start()
+        STARTUP.mark('сессия Pinterest')
+        self.maintenance_task = asyncio.create_task(self.maintenance())
+        # Рассылают нулевые воркеры всех машин: с Redis слот создает одна копия, доставки разбирают все,
+        # без Redis машина одна
+        if DIGEST_INTERVAL and self.worker == 0:
+            self.digest_task = asyncio.create_task(self.digest_loop())
+        if self.metrics_port:
+            await self.metrics_server.start(METRICS_HOST, self.metrics_port)
+        STARTUP.finish()
+    
+    async def post_shutdown(self, application: Application):
+        await self.metrics_server.stop()
+        if self.maintenance_task is not None:
+            self.maintenance_task.cancel()
+        if self.digest_task is not None:
+            # Недоотправленное доотправится после перезапуска
+            self.digest_task.cancel()
+            await asyncio.gather(self.digest_task, return_exceptions=True)
+        self.save_state()
+        try:
+            self.save_warm_state()
+        except Exception as e:
+            logger.error(f"Не удалось сохранить теплый снимок: {e}")
+        self.data_manager.close()
+        self.broadcasts.close()
+        await self.pinterest.close()
+        await self.state.close()
+        logger.info(f"Кэш file_id: {self.file_ids.cache.stats}")
+    
+    async def maintenance(self):
+        """Периодически сбрасывает накопленное состояние на диск"""
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            try:
+                self.save_state()
+            except Exception as e:
+                logger.error(f"Ошибка сохранения состояния: {e}")
+    
+    async def digest_loop(self):
+        """Раз в DIGEST_INTERVAL рассылает подписчикам свежие пины и доотправляет прерванные рассылки"""
+        while True:
+            try:
+                await self.run_digests()
+            except Exception as e:
+                logger.error(f"Ошибка рассылки: {e}")
+            await asyncio.sleep(DIGEST_CHECK)
+    
+    async def run_digests(self):
+        slot = int(time.time() // DIGEST_INTERVAL)
+        for category in CATEGORIES:
+            if not await self.broadcasts.has_slot(category, slot) and await self.broadcasts.subscriber_count(category):
+                await self.create_digest(category, slot)
+        for broadcast_id, category, urls in await self.broadcasts.unfinished():
+            await self.send_broadcast(broadcast_id, category, urls)
+    
+    async def create_digest(self, category: str, slot: int) -> Optional[int]:
+        """Рассылка категории: лента загружается один раз, на всех подписчиков"""
+        if not self.pinterest.is_authenticated:
+            return None
+        urls = await self.pinterest.feed_cache.get(category)
+        if len(urls) < DIGEST_SIZE:
+            urls = await self.pinterest.feed_cache.refill(category)
+        if not urls:
+            return None
+        return await self.broadcasts.create(category, slot, urls)
+    
+    async def send_broadcast(self, broadcast_id: int, category: str, urls: List[str]):
+        logger.info(f"Рассылка #{broadcast_id} ({category})")
+        
+        async def sender():
+            # Подписчиков берем по одному: с Redis ту же рассылку могут разбирать и другие копии
+            while True:
+                chat_id = await self.broadcasts.claim(broadcast_id)
+                if chat_id is None:
+                    return
+                await self.deliver(broadcast_id, chat_id, category, urls)
+        
+        await asyncio.gather(*(sender() for _ in range(DIGEST_CONCURRENCY)))
+        summary = await self.broadcasts.finish(broadcast_id)
+        if summary is not None:
+            logger.info(f"✅ Рассылка #{broadcast_id} ({category}) завершена: {summary}")
+    
+    async def deliver(self, broadcast_id: int, chat_id: int, category: str, urls: List[str]):
+        """Одному подписчику — непросмотренные им пины из общей выборки"""
+        user = str(chat_id)
+        sent = 0
+        try:
+            # Как и в ленте: похожие на просмотренные картинки подписчику не шлем
+            images, marks = await self.pinterest.select_unseen(urls, category, DIGEST_SIZE, user)
+            if images:
+                # Своя доля общего лимита, чтобы рассылка не тормозила живых пользователей
+                await self.digest_bucket.acquire(len(images))
+                sent = await self.send_photos(chat_id, images, f"🔔 {CATEGORY_LABELS[category]}: свежее из ленты")
+                if sent:
+                    # Недошедшие не помечаем — при повторе рассылки они уйдут снова
+                    await self.state.mark_seen(user, category, marks)
+                status = 'sent' if sent else 'failed'
+            else:
+                status = 'skipped'
+        except Forbidden:
+            await self.broadcasts.unsubscribe_all(chat_id)
+            status = 'blocked'
+        except Exception as e:
+            logger.error(f"Рассылка #{broadcast_id}, чат {chat_id}: {e}")
+            status = 'failed'
+        await self.broadcasts.done(broadcast_id, chat_id, status, sent)
+        DIGEST_DELIVERIES_TOTAL.inc(category=category, status=status)
+    
+    def register_metrics(self):
+        """Счетчики, которые компоненты уже ведут в stats, отдаются в /metrics как есть"""
+        pinterest = self.pinterest
+        METRICS.gauge('seen_size', 'Фильтры просмотренных картинок в памяти', ('kind',), self.state.seen_stats)
+        METRICS.gauge('data_file_bytes', 'Размер хранилища данных на диске', fn=self.data_manager.size_bytes)
+        METRICS.gauge('pinterest_accounts', 'Аккаунты Pinterest по состоянию', ('state',),
+                      pinterest.cookie_pool.state_counts)
+        METRICS.gauge('breaker_open', 'Предохранитель Pinterest: 0 — замкнут, 1 — проба, 2 — разомкнут',
+                      fn=lambda: ('closed', 'half_open', 'open').index(pinterest.breaker.state))
+        METRICS.stats('breaker_transitions_total', 'Переходы предохранителя Pinterest', 'event',
+                      lambda: pinterest.breaker.stats)
+        METRICS.stats('feed_cache_total', 'Буфер ленты', 'event', lambda: pinterest.feed_cache.stats)
+        METRICS.stats('singleflight_total', 'Склейка одинаковых запросов', 'event', lambda: pinterest.flights.stats)
+        METRICS.stats('image_size_cache_total', 'Кэш размеров картинок', 'event', lambda: pinterest.image_sizes.stats)
+        METRICS.stats('image_hashes_total', 'Перцептивные хеши картинок', 'event', lambda: pinterest.image_hashes.stats)
+        METRICS.stats('http_connections_total', 'Соединения HTTP-сессии Pinterest', 'event', lambda: pinterest.stats)
+        METRICS.stats('file_id_cache_total', 'Кэш file_id', 'event', lambda: self.file_ids.cache.stats)
+        METRICS.gauge('startup_seconds', 'Длительность фаз запуска', ('phase',), lambda: dict(STARTUP.phases))
+    
+    def restore_warm_state(self):
+        snapshot = self.warm_state.load()
+        if snapshot:
+            self.state.restore(snapshot.get('state', {}))
+            self.pinterest.restore(snapshot.get('pinterest', {}))
+    
+    def save_warm_state(self):
+        self.warm_state.save({'state': self.state.snapshot(), 'pinterest': self.pinterest.snapshot()})
+    
+    def save_state(self):
+        with STATE_SAVE_SECONDS.time():
+            self.file_ids.save()
+            self.pinterest.image_hashes.save()
+            self.state.save()
+            self.data_manager.save()
     
     def setup_handlers(self):
+        # Состояние диалога живет в общем хранилище: до обработчиков подгружаем, после — сохраняем
+        self.application.add_handler(TypeHandler(Update, self.load_user_state), group=-1)
+        self.application.add_handler(TypeHandler(Update, self.save_user_state), group=1)
         self.application.add_handler(CommandHandler("start", self.start))
+        self.application.add_handler(CommandHandler("find", self.find))
         self.application.add_handler(CallbackQueryHandler(self.callback))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.text))
         self.application.add_handler(MessageHandler(filters.Document.ALL, self.document))
         self.application.add_handler(MessageHandler(filters.PHOTO, self.photo))
         self.application.add_error_handler(self.error)
     
+    async def send_photos(self, chat_id: int, urls: List[str], caption: str) -> int:
+        """Отправляет фото альбомами и возвращает, сколько дошло"""
+        sent = 0
+        for i in range(0, len(urls), MEDIA_GROUP_SIZE):
+            sent += await self.send_album(chat_id, urls[i:i + MEDIA_GROUP_SIZE], caption)
+        return sent
+    
+    async def send_album(self, chat_id: int, urls: List[str], caption: str) -> int:
+        """Один альбом; фото, которое Telegram отверг, выкидываем и пробуем снова.
+        
+        Уже отправленные раньше фото идут по file_id — Telegram не качает их заново.
+        """
+        bot = self.application.bot
+        urls = list(urls)
+        while urls:
+            sources = [self.file_ids.get(url) or url for url in urls]
+            await self.send_limiter.acquire(chat_id, len(urls))
+            try:
+                if len(urls) == 1:
+                    # Альбом — минимум два фото
+                    with TELEGRAM_SEND_SECONDS.time(method='send_photo'):
+                        message = await bot.send_photo(chat_id, photo=sources[0], caption=caption)
+                    self.file_ids.remember(urls, [message])
+                    return 1
+                media = [InputMediaPhoto(src, caption=caption if i == 0 else None) for i, src in enumerate(sources)]
+                with TELEGRAM_SEND_SECONDS.time(method='send_media_group'):
+                    messages = await bot.send_media_group(chat_id, media)
+                self.file_ids.remember(urls, messages)
+                return len(messages)
+            except RetryAfter as e:
+                SEND_FAILURES_TOTAL.inc(reason='retry_after')
+                await asyncio.sleep(e.retry_after)
+            except BadRequest as e:
+                SEND_FAILURES_TOTAL.inc(reason='bad_request')
+                logger.error(f"Ошибка: {e}")
+                # "Failed to send message #3 with the error message ..."
+                match = re.search(r'message #(\d+)', str(e))
+                if len(urls) == 1:
+                    bad = 0
+                elif match and 1 <= int(match.group(1)) <= len(urls):
+                    bad = int(match.group(1)) - 1
+                else:
+                    # Непонятно, какое фото плохое — шлем по одному
+                    sent = 0
+                    for url in urls:
+                        sent += await self.send_album(chat_id, [url], caption)
+                    return sent
+                
+                if sources[bad] != urls[bad]:
+                    # Устаревший file_id — повторим по ссылке
+                    self.file_ids.forget(urls[bad])
+                else:
+                    urls.pop(bad)
+            except Forbidden:
+                # Пользователь заблокировал бота — слать в этот чат больше нечего
+                SEND_FAILURES_TOTAL.inc(reason='forbidden')
+                raise
+            except TelegramError as e:
+                SEND_FAILURES_TOTAL.inc(reason='error')
+                logger.error(f"Ошибка: {e}")
+                return 0
+        return 0
+    
+    async def load_user_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user:
+            data = await self.state.get_user_state(str(update.effective_user.id))
+            context.user_data.clear()
+            context.user_data.update(data)
+    
+    async def save_user_state(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if update.effective_user:
+            await self.state.set_user_state(str(update.effective_user.id), dict(context.user_data))
+    
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         auth = "✅" if self.pinterest.is_authenticated else "❌"
         keyboard = [
@@ -239,6 +3473,8 @@ class TelegramBot:
             [InlineKeyboardButton("📸 Скриншоты", callback_data='menu_screens')],
             [InlineKeyboardButton("🎥 Видео", callback_data='menu_videos')],
             [InlineKeyboardButton("📝 Заметки", callback_data='menu_notes')],
+            [InlineKeyboardButton("🔍 Поиск", callback_data='menu_find')],
+            [InlineKeyboardButton("🔔 Подписки", callback_data='menu_subs')],
             [InlineKeyboardButton(f"🖥️ Обои ПК {auth}", callback_data='menu_pc')],
             [InlineKeyboardButton(f"📱 Обои телефон {auth}", callback_data='menu_phone')],
             [InlineKeyboardButton("🍪 Загрузить куки", callback_data='load_cookies')]
@@ -269,14 +3505,7 @@ class TelegramBot:
             
             images = await self.pinterest.get_my_feed('avatars', 10, str(update.effective_user.id))
             
-            sent = 0
-            for url in images[:6]:
-                try:
-                    await query.message.reply_photo(photo=url, caption="✨ Твоя рекомендация")
-                    sent += 1
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Ошибка: {e}")
+            sent = await self.send_photos(query.message.chat_id, images[:6], "✨ Твоя рекомендация")
             
             await query.message.reply_text(
                 f"✅ Найдено: {len(images)}, отправлено: {sent}",
@@ -293,14 +3522,7 @@ class TelegramBot:
             
             images = await self.pinterest.get_my_feed('wallpapers_pc', 8, str(update.effective_user.id))
             
-            sent = 0
-            for url in images[:4]:
-                try:
-                    await query.message.reply_photo(photo=url, caption="🖥️ Твоя рекомендация")
-                    sent += 1
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Ошибка: {e}")
+            sent = await self.send_photos(query.message.chat_id, images[:4], "🖥️ Твоя рекомендация")
             
             await query.message.reply_text(
                 f"✅ Найдено: {len(images)}, отправлено: {sent}",
@@ -317,14 +3539,7 @@ class TelegramBot:
             
             images = await self.pinterest.get_my_feed('wallpapers_phone', 8, str(update.effective_user.id))
             
-            sent = 0
-            for url in images[:4]:
-                try:
-                    await query.message.reply_photo(photo=url, caption="📱 Твоя рекомендация")
-                    sent += 1
-                    await asyncio.sleep(0.5)
-                except Exception as e:
-                    logger.error(f"Ошибка: {e}")
+            sent = await self.send_photos(query.message.chat_id, images[:4], "📱 Твоя рекомендация")
             
             await query.message.reply_text(
                 f"✅ Найдено: {len(images)}, отправлено: {sent}",
@@ -379,6 +3594,37 @@ class TelegramBot:
             context.user_data['state'] = 'waiting_note'
             return
         
+        # ===== ПОДПИСКИ =====
+        if query.data == 'menu_subs':
+            await self.show_subscriptions(query)
+            return
+        
+        if query.data.startswith('sub_'):
+            category = query.data[len('sub_'):]
+            if category in CATEGORY_LABELS:
+                chat_id = query.message.chat_id
+                await self.broadcasts.subscribe(chat_id, category, category not in await self.broadcasts.subscriptions(chat_id))
+            await self.show_subscriptions(query)
+            return
+        
+        # ===== ПОИСК =====
+        if query.data == 'menu_find':
+            await query.edit_message_text(
+                "🔍 Что найти? Ищу по заметкам, файлам, видео, скриншотам и настройкам игр",
+                reply_markup=InlineKeyboardMarkup([[
+                    InlineKeyboardButton("🔙 Назад", callback_data='back')
+                ]])
+            )
+            context.user_data['state'] = 'waiting_find'
+            return
+        
+        if query.data.startswith('fpage_'):
+            _, page, _ = query.data.split('_', 2)
+            text, markup = self.find_page(str(update.effective_user.id), context.user_data.get('find_query', ''),
+                                          int(page))
+            await query.edit_message_text(text, reply_markup=markup)
+            return
+        
         # ===== НАСТРОЙКИ ИГР =====
         if query.data == 'menu_games':
             keyboard = []
@@ -388,24 +3634,17 @@ class TelegramBot:
             await query.edit_message_text("Выбери игру:", reply_markup=InlineKeyboardMarkup(keyboard))
             return
         
+        if query.data == 'noop':
+            return
+        
         if query.data.startswith('game_'):
             game = query.data.replace('game_', '')
-            settings = self.data_manager.get_items('game_settings', game)
-            
-            text = f"⚙️ {game}\n\n"
-            if settings:
-                for i, s in enumerate(settings, 1):
-                    text += f"{i}. {s['name']}: {s['value']}\n"
-            else:
-                text += "Нет настроек"
-            
-            keyboard = [
-                [InlineKeyboardButton("➕ Добавить", callback_data=f'add_{game}')],
-                [InlineKeyboardButton("🗑️ Удалить", callback_data=f'del_{game}')],
-                [InlineKeyboardButton("🔙 Назад", callback_data='menu_games')]
-            ]
-            await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
-            context.user_data['current_game'] = game
+            await self.show_game(query, context, game, 0)
+            return
+        
+        if query.data.startswith('gpage_'):
+            _, page, game = query.data.split('_', 2)
+            await self.show_game(query, context, game, int(page))
             return
         
         if query.data.startswith('add_'):
@@ -416,20 +3655,12 @@ class TelegramBot:
         
         if query.data.startswith('del_'):
             game = query.data.replace('del_', '')
-            settings = self.data_manager.get_items('game_settings', game)
-            
-            if not settings:
-                await query.edit_message_text("❌ Нет настроек")
-                return
-            
-            keyboard = []
-            for i, s in enumerate(settings):
-                keyboard.append([InlineKeyboardButton(
-                    f"❌ {s['name']}", callback_data=f'delete_{game}_{i}'
-                )])
-            keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'game_{game}')])
-            
-            await query.edit_message_text("Что удалить?", reply_markup=InlineKeyboardMarkup(keyboard))
+            await self.show_delete_menu(query, game, 0)
+            return
+        
+        if query.data.startswith('dpage_'):
+            _, page, game = query.data.split('_', 2)
+            await self.show_delete_menu(query, game, int(page))
             return
         
         if query.data.startswith('delete_'):
@@ -437,7 +3668,7 @@ class TelegramBot:
             game = parts[1]
             idx = int(parts[2])
             
-            if self.data_manager.delete_item('game_settings', idx, game):
+            if self.data_manager.delete_item('game_settings', idx, game, str(update.effective_user.id)):
                 await query.edit_message_text("✅ Удалено")
             else:
                 await query.edit_message_text("❌ Ошибка")
@@ -446,6 +3677,108 @@ class TelegramBot:
             await query.message.reply_text("Вернуться", reply_markup=InlineKeyboardMarkup(keyboard))
             return
     
+    def page_buttons(self, prefix: str, game: str, page: int, total: int) -> List[InlineKeyboardButton]:
+        """Кнопки листания: ◀️ 2/5 ▶️"""
+        pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
+        if pages == 1:
+            return []
+        buttons = []
+        if page > 0:
+            buttons.append(InlineKeyboardButton("◀️", callback_data=f'{prefix}_{page - 1}_{game}'))
+        buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data='noop'))
+        if page < pages - 1:
+            buttons.append(InlineKeyboardButton("▶️", callback_data=f'{prefix}_{page + 1}_{game}'))
+        return buttons
+    
+    async def show_game(self, query, context: ContextTypes.DEFAULT_TYPE, game: str, page: int):
+        user = str(query.from_user.id)
+        total = self.data_manager.count_items('game_settings', user, game)
+        page = min(max(page, 0), max(0, (total - 1) // PAGE_SIZE))
+        settings = self.data_manager.get_items('game_settings', user, page * PAGE_SIZE, PAGE_SIZE, game)
+        
+        text = f"⚙️ {game}\n\n"
+        if settings:
+            for i, s in enumerate(settings, page * PAGE_SIZE + 1):
+                # Длинные значения обрезаем, чтобы страница влезла в одно сообщение
+                text += f"{i}. {s['name'][:50]}: {s['value'][:200]}\n"
+        else:
+            text += "Нет настроек"
+        
+        keyboard = [
+            [InlineKeyboardButton("➕ Добавить", callback_data=f'add_{game}')],
+            [InlineKeyboardButton("🗑️ Удалить", callback_data=f'del_{game}')],
+            [InlineKeyboardButton("🔙 Назад", callback_data='menu_games')]
+        ]
+        nav = self.page_buttons('gpage', game, page, total)
+        if nav:
+            keyboard.insert(0, nav)
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+        context.user_data['current_game'] = game
+    
+    async def show_subscriptions(self, query):
+        subscribed = await self.broadcasts.subscriptions(query.message.chat_id)
+        keyboard = [
+            [InlineKeyboardButton(f"{'✅' if category in subscribed else '➖'} {label}", callback_data=f'sub_{category}')]
+            for category, label in CATEGORY_LABELS.items()
+        ]
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data='back')])
+        text = "🔔 Подписки: свежие пины из ленты приходят сами"
+        if DIGEST_INTERVAL >= 3600:
+            text += f" раз в {DIGEST_INTERVAL // 3600} ч"
+        elif DIGEST_INTERVAL:
+            text += f" раз в {DIGEST_INTERVAL // 60 or 1} мин"
+        await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+    
+    def find_page(self, user: str, text: str, page: int) -> Tuple[str, InlineKeyboardMarkup]:
+        """Страница результатов поиска и кнопки к ней"""
+        results = self.data_manager.search(user, text)
+        keyboard = [[InlineKeyboardButton("🔍 Искать еще", callback_data='menu_find')],
+                    [InlineKeyboardButton("🔙 Назад", callback_data='back')]]
+        if not results:
+            return f"🔍 По запросу «{text[:50]}» ничего не нашлось", InlineKeyboardMarkup(keyboard)
+        
+        page = min(max(page, 0), (len(results) - 1) // PAGE_SIZE)
+        lines = [f"🔍 «{text[:50]}»: найдено {len(results)}\n"]
+        for i, (item_id, category, game, title) in enumerate(results[page * PAGE_SIZE:(page + 1) * PAGE_SIZE],
+                                                           page * PAGE_SIZE + 1):
+            where = f" ({game})" if game else ""
+            lines.append(f"{i}. {SEARCH_LABELS.get(category, '')} {title[:80]}{where}")
+        nav = self.page_buttons('fpage', '', page, len(results))
+        if nav:
+            keyboard.insert(0, nav)
+        return '\n'.join(lines), InlineKeyboardMarkup(keyboard)
+    
+    async def find(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        text = ' '.join(context.args)
+        if not text:
+            await update.message.reply_text("🔍 Что найти? Напиши запрос или /find запрос")
+            context.user_data['state'] = 'waiting_find'
+            return
+        context.user_data['find_query'] = text
+        answer, markup = self.find_page(str(update.effective_user.id), text, 0)
+        await update.message.reply_text(answer, reply_markup=markup)
+    
+    async def show_delete_menu(self, query, game: str, page: int):
+        user = str(query.from_user.id)
+        total = self.data_manager.count_items('game_settings', user, game)
+        if not total:
+            await query.edit_message_text("❌ Нет настроек")
+            return
+        
+        page = min(max(page, 0), (total - 1) // PAGE_SIZE)
+        settings = self.data_manager.get_items('game_settings', user, page * PAGE_SIZE, PAGE_SIZE, game)
+        keyboard = []
+        for i, s in enumerate(settings, page * PAGE_SIZE):
+            keyboard.append([InlineKeyboardButton(
+                f"❌ {s['name'][:50]}", callback_data=f'delete_{game}_{i}'
+            )])
+        nav = self.page_buttons('dpage', game, page, total)
+        if nav:
+            keyboard.append(nav)
+        keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data=f'game_{game}')])
+        
+        await query.edit_message_text("Что удалить?", reply_markup=InlineKeyboardMarkup(keyboard))
+    
     async def document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         state = context.user_data.get('state')
         doc = update.message.document
@@ -465,8 +3798,10 @@ class TelegramBot:
                     if 'name' in item and 'value' in item:
                         cookies[item['name']] = item['value']
                 
-                if self.pinterest.save_cookies(cookies):
-                    await update.message.reply_text("✅ Куки загружены! Теперь будут ТВОИ рекомендации")
+                if await self.pinterest.save_cookies(cookies):
+                    await update.message.reply_text(
+                        f"✅ Куки загружены! Аккаунтов в пуле: {len(self.pinterest.cookie_pool)}"
+                    )
                 else:
                     await update.message.reply_text("❌ Ошибка")
                 
@@ -484,7 +3819,7 @@ class TelegramBot:
                 'file_id': doc.file_id,
                 'date': datetime.now().isoformat()
             }
-            self.data_manager.add_item('files', info)
+            self.data_manager.add_item('files', info, user=str(update.effective_user.id))
             await update.message.reply_text("✅ Файл сохранен")
             context.user_data['state'] = None
             await self.start(update, context)
@@ -496,7 +3831,7 @@ class TelegramBot:
                 'file_id': doc.file_id,
                 'date': datetime.now().isoformat()
             }
-            self.data_manager.add_item('videos', info)
+            self.data_manager.add_item('videos', info, user=str(update.effective_user.id))
             await update.message.reply_text("✅ Видео сохранено")
             context.user_data['state'] = None
             await self.start(update, context)
@@ -514,7 +3849,7 @@ class TelegramBot:
                 'caption': update.message.caption or '',
                 'date': datetime.now().isoformat()
             }
-            self.data_manager.add_item('screenshots', info)
+            self.data_manager.add_item('screenshots', info, user=str(update.effective_user.id))
             await update.message.reply_text("✅ Скриншот сохранен")
             context.user_data['state'] = None
             await self.start(update, context)
@@ -531,7 +3866,7 @@ class TelegramBot:
             content = lines[1] if len(lines) > 1 else ''
             
             note = {'title': title, 'content': content, 'date': datetime.now().isoformat()}
-            self.data_manager.add_item('notes', note)
+            self.data_manager.add_item('notes', note, user=str(update.effective_user.id))
             await update.message.reply_text(f"✅ Заметка '{title}' сохранена")
             context.user_data['state'] = None
             await self.start(update, context)
@@ -542,7 +3877,7 @@ class TelegramBot:
             if ':' in text:
                 name, val = text.split(':', 1)
                 setting = {'name': name.strip(), 'value': val.strip(), 'date': datetime.now().isoformat()}
-                self.data_manager.add_item('game_settings', setting, game)
+                self.data_manager.add_item('game_settings', setting, game, str(update.effective_user.id))
                 await update.message.reply_text("✅ Добавлено")
             else:
                 await update.message.reply_text("❌ Формат: Название: значение")
@@ -552,6 +3887,13 @@ class TelegramBot:
             await update.message.reply_text("Вернуться", reply_markup=InlineKeyboardMarkup(keyboard))
             return
         
+        if state == 'waiting_find':
+            context.user_data['state'] = None
+            context.user_data['find_query'] = text
+            answer, markup = self.find_page(str(update.effective_user.id), text, 0)
+            await update.message.reply_text(answer, reply_markup=markup)
+            return
+        
         await update.message.reply_text("Используй /start")
     
     async def error(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -559,7 +3901,51 @@ class TelegramBot:
     
     def run(self):
         print("✅ Бот запущен")
-        self.application.run_polling()
+        if WEBHOOK_URL:
+            asyncio.run(self.run_webhook())
+        else:
+            self.application.run_polling()
+    
+    async def run_webhook(self):
+        """Прием апдейтов через вебхук вместо опроса.
+        
+        Вебхук при остановке не снимается: за балансировщиком может работать
+        несколько копий бота, и остальные продолжают принимать апдейты.
+        """
+        application = self.application
+        secret = WEBHOOK_SECRET or hashlib.sha256(self.token.encode()).hexdigest()[:32]
+        server = WebhookServer(application, WEBHOOK_PATH, secret)
+        
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        
+        await application.initialize()
+        await self.post_init(application)
+        await application.start()
+        await server.start(WEBHOOK_HOST, WEBHOOK_PORT)
+        try:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=secret,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=UPDATE_WORKERS
+            )
+            server.ready = True
+            logger.info(f"✅ Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+            await stop.wait()
+        finally:
+            # Сначала перестаем принимать, потом дорабатываем уже принятые апдейты
+            server.ready = False
+            await server.stop()
+            await application.stop()
+            await application.shutdown()
+            await self.post_shutdown(application)
+
+
+def run_worker(token: str, worker: int = 0):
+    TelegramBot(token, worker).run()
 
 
 def main():
@@ -567,7 +3953,28 @@ def main():
     if not token:
         print("❌ Нет токена")
         return
-    TelegramBot(token).run()
+    
+    if WEBHOOK_URL and WEBHOOK_WORKERS > 1:
+        # Воркеры делят каталог: просмотренные в памяти и журналы пользователей перетирали бы друг друга
+        if not REDIS_URL:
+            logger.error("WEBHOOK_WORKERS > 1 требует REDIS_URL: без него воркеры перетирают состояние друг друга")
+            return
+        if STORAGE_BACKEND == 'journal':
+            logger.error("STORAGE_BACKEND=journal рассчитан на один процесс: для WEBHOOK_WORKERS > 1 нужен sqlite")
+            return
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(token, i), name=f'worker-{i}')
+            for i in range(WEBHOOK_WORKERS)
+        ]
+        for worker in workers:
+            worker.start()
+        # SIGTERM пересылаем воркерам — каждый сам дорабатывает принятые апдейты
+        signal.signal(signal.SIGTERM, lambda *args: [w.terminate() for w in workers])
+        for worker in workers:
+            worker.join()
+        return
+    
+    run_worker(token)
 
 
 if __name__ == '__main__':
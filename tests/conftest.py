@@ -0,0 +1,32 @@
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+FIXTURES = os.path.join(ROOT, 'bench', 'fixtures')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Бот пишет файлы состояния в текущий каталог — уводим их во временный"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(scope='session')
+def redis_url():
+    """Адрес fakeredis — локальной замены Redis, говорящей по тому же протоколу"""
+    fakeredis = pytest.importorskip('fakeredis')
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = fakeredis.TcpFakeServer(('127.0.0.1', port), server_type='redis')
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'redis://127.0.0.1:{port}/0'
+    server.shutdown()
+    server.server_close()
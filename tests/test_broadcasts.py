@@ -0,0 +1,129 @@
+"""Подписки и рассылки: SQLite на одной машине и Redis, общий для двух копий бота"""
+import asyncio
+import itertools
+
+import pytest
+
+import bot_complete
+
+_prefixes = itertools.count()
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def hosts(request, workdir):
+    """Фабрика пары хранилищ «на двух машинах»: для SQLite это одно и то же хранилище"""
+    if request.param == 'sqlite':
+        def make():
+            store = bot_complete.BroadcastStore('broadcast.sqlite3')
+            return [store, store], []
+    else:
+        url = request.getfixturevalue('redis_url')
+        prefix = f'bc{next(_prefixes)}:'
+
+        def make():
+            states = [bot_complete.RedisState(url, prefix=prefix) for _ in range(2)]
+            return [bot_complete.create_broadcasts(state) for state in states], states
+    return make
+
+
+def run(hosts, scenario):
+    async def main():
+        stores, states = hosts()
+        try:
+            return await scenario(*stores)
+        finally:
+            for store in stores:
+                store.close()
+            for state in states:
+                await state.close()
+    return asyncio.run(main())
+
+
+def test_subscription_is_visible_to_every_host(hosts):
+    async def scenario(a, b):
+        await a.subscribe(1, 'avatars')
+        await a.subscribe(1, 'wallpapers_pc')
+        await a.subscribe(2, 'avatars')
+        await b.subscribe(2, 'avatars', False)
+        seen = await b.subscriptions(1), await b.subscriber_count('avatars')
+        await b.unsubscribe_all(1)
+        return seen, await a.subscriptions(1), await a.subscriber_count('avatars')
+
+    assert run(hosts, scenario) == (({'avatars', 'wallpapers_pc'}, 1), set(), 0)
+
+
+def test_each_subscriber_gets_one_delivery_across_hosts(hosts):
+    async def scenario(a, b):
+        for chat_id in range(1, 21):
+            await a.subscribe(chat_id, 'avatars')
+        first = await a.create('avatars', 7, ['u1', 'u2'])
+        second = await b.create('avatars', 7, ['u3'])
+        assert first is not None and second is None
+        assert await b.has_slot('avatars', 7) and not await b.has_slot('avatars', 8)
+        assert await b.unfinished() == [(first, 'avatars', ['u1', 'u2'])]
+
+        delivered = []
+
+        async def sender(store):
+            while (chat_id := await store.claim(first)) is not None:
+                delivered.append(chat_id)
+                await asyncio.sleep(0)
+                await store.done(first, chat_id, 'sent' if chat_id % 5 else 'blocked', 1)
+
+        await asyncio.gather(*(sender(store) for store in (a, b, a, b)))
+        summaries = [await a.finish(first), await b.finish(first)]
+        return sorted(delivered), summaries, await a.unfinished()
+
+    delivered, summaries, unfinished = run(hosts, scenario)
+    assert delivered == list(range(1, 21))
+    # Итог отдает только закрывшая рассылку копия
+    assert summaries[0] == {'sent': 16, 'blocked': 4}
+    assert summaries[1] is None
+    assert unfinished == []
+
+
+def test_unfinished_broadcast_stays_open_while_deliveries_are_claimed(hosts):
+    async def scenario(a, b):
+        await a.subscribe(1, 'avatars')
+        broadcast_id = await a.create('avatars', 1, ['u'])
+        assert await a.claim(broadcast_id) == 1
+        return await b.finish(broadcast_id), await b.claim(broadcast_id)
+
+    assert run(hosts, scenario) == (None, None)
+
+
+def test_sqlite_resends_claimed_delivery_after_restart(workdir):
+    async def scenario():
+        store = bot_complete.BroadcastStore('broadcast.sqlite3')
+        await store.subscribe(1, 'avatars')
+        broadcast_id = await store.create('avatars', 1, ['u'])
+        assert await store.claim(broadcast_id) == 1
+        store.close()  # упали посреди отправки
+        store = bot_complete.BroadcastStore('broadcast.sqlite3')
+        try:
+            return await store.claim(broadcast_id)
+        finally:
+            store.close()
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_redis_requeues_delivery_claimed_by_a_dead_host(redis_url, monkeypatch):
+    async def scenario():
+        states = [bot_complete.RedisState(redis_url, prefix=f'bc{next(_prefixes)}:') for _ in range(2)]
+        states[1].prefix = states[0].prefix
+        dead, alive = (bot_complete.create_broadcasts(state) for state in states)
+        try:
+            await dead.subscribe(1, 'avatars')
+            broadcast_id = await dead.create('avatars', 1, ['u'])
+            assert await dead.claim(broadcast_id) == 1
+            await alive.unfinished()
+            assert await alive.claim(broadcast_id) is None  # копия, может, еще отправляет
+            monkeypatch.setattr(bot_complete, 'DIGEST_CLAIM_TIMEOUT', -1)
+            await alive.unfinished()
+            return await alive.claim(broadcast_id)
+        finally:
+            for state in states:
+                await state.close()
+
+    assert asyncio.run(scenario()) == 1
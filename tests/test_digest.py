@@ -0,0 +1,65 @@
+import asyncio
+import types
+
+import bot_complete
+
+
+class Broadcasts:
+    def __init__(self):
+        self.done_calls = []
+
+    async def done(self, broadcast_id, chat_id, status, sent):
+        self.done_calls.append((chat_id, status, sent))
+
+
+def fake_bot(sent_ok=True):
+    """Ровно то, чем пользуется TelegramBot.deliver"""
+    state = bot_complete.MemoryState(seen_file='seen.bin')
+    pinterest = bot_complete.PinterestSession(state, image_hashes_file='hashes.bin')
+    bot = types.SimpleNamespace(state=state, pinterest=pinterest, broadcasts=Broadcasts(), sent=[])
+
+    async def acquire(count):
+        pass
+
+    async def send_photos(chat_id, images, caption):
+        bot.sent.append(list(images))
+        return len(images) if sent_ok else 0
+
+    bot.digest_bucket = types.SimpleNamespace(acquire=acquire)
+    bot.send_photos = send_photos
+    return bot
+
+
+def deliver(bot, urls):
+    return bot_complete.TelegramBot.deliver(bot, 1, 42, 'wallpapers_pc', urls)
+
+
+def test_digest_skips_near_duplicates_of_seen_pins(workdir):
+    bot = fake_bot()
+    hashes = bot.pinterest.image_hashes
+    hashes.add('http://i/a.jpg', 0b1111)
+    hashes.add('http://i/a-copy.jpg', 0b1110)  # на бит отличается — та же картинка
+    hashes.add('http://i/b.jpg', 0b1111 << 40)
+
+    async def main():
+        # Пользователь уже видел a.jpg в ленте — ее копия в рассылку не попадет
+        await bot.pinterest.take_unseen(['http://i/a.jpg'], 'wallpapers_pc', 10, '42')
+        await deliver(bot, ['http://i/a-copy.jpg', 'http://i/b.jpg', 'http://i/c.jpg'])
+        # Группа b.jpg помечена после отправки: похожая из следующей выборки тоже отсеется
+        hashes.add('http://i/b-copy.jpg', (0b1111 << 40) | 1)
+        return await bot.pinterest.take_unseen(['http://i/b-copy.jpg', 'http://i/d.jpg'], 'wallpapers_pc', 10, '42')
+
+    assert asyncio.run(main()) == ['http://i/d.jpg']
+    assert bot.sent == [['http://i/b.jpg', 'http://i/c.jpg']]
+    assert bot.broadcasts.done_calls == [(42, 'sent', 2)]
+
+
+def test_failed_digest_is_not_marked_seen(workdir):
+    bot = fake_bot(sent_ok=False)
+
+    async def main():
+        await deliver(bot, ['http://i/a.jpg'])
+        return await bot.state.seen_many('42', 'wallpapers_pc', ['http://i/a.jpg'])
+
+    assert asyncio.run(main()) == [False]
+    assert bot.broadcasts.done_calls == [(42, 'failed', 0)]
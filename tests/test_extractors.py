@@ -0,0 +1,31 @@
+import os
+
+import pytest
+
+import bot_complete
+from conftest import FIXTURES
+
+
+@pytest.fixture(scope='module')
+def home_html():
+    with open(os.path.join(FIXTURES, 'home.html'), encoding='utf-8') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('name', ['lxml', 'bs4'])
+def test_extractors_agree_on_fixture(home_html, name):
+    if name == 'lxml' and not bot_complete.HAS_LXML:
+        pytest.skip('lxml не установлен')
+    expected = bot_complete.extract_images(home_html, 'regex')
+    assert expected
+    assert bot_complete.extract_images(home_html, name) == expected
+
+
+def test_regex_skips_comments_and_scripts():
+    html = (
+        '<!-- <img src="https://i.pinimg.com/236x/a.jpg"> -->'
+        '<script>document.write(\'<img src="https://i.pinimg.com/236x/b.jpg">\')</script>'
+        '<img alt=">" src="https://i.pinimg.com/236x/c.jpg?x=1&amp;y=2">'
+    )
+    for name in ('regex', 'bs4'):
+        assert bot_complete.extract_images(html, name) == ['https://i.pinimg.com/236x/c.jpg?x=1&y=2']
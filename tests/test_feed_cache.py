@@ -0,0 +1,36 @@
+import asyncio
+
+import pytest
+
+import bot_complete
+
+
+def test_feed_cache_reports_expired(workdir):
+    async def main():
+        state = bot_complete.MemoryState(seen_file='seen.bin')
+        cache = bot_complete.FeedCache(lambda category: asyncio.sleep(0, []), state, ttl=0.01, low_water=0)
+        await state.pool_put('avatars', ['a', 'b'], 0.01, 10)
+        await asyncio.sleep(0.02)
+        await cache.get('avatars')
+        return cache.stats['expired']
+
+    assert asyncio.run(main()) == 2
+
+
+@pytest.mark.parametrize('redis_url, backend', [(None, 'sqlite'), ('redis://127.0.0.1:1/0', 'journal')])
+def test_several_workers_refuse_unsafe_setup(monkeypatch, redis_url, backend):
+    monkeypatch.setenv('TELEGRAM_BOT_TOKEN', '1:x')
+    monkeypatch.setattr(bot_complete, 'WEBHOOK_URL', 'https://bot.example.com')
+    monkeypatch.setattr(bot_complete, 'WEBHOOK_WORKERS', 2)
+    monkeypatch.setattr(bot_complete, 'REDIS_URL', redis_url)
+    monkeypatch.setattr(bot_complete, 'STORAGE_BACKEND', backend)
+    started = []
+    monkeypatch.setattr(bot_complete, 'run_worker', lambda *args: started.append(args))
+    monkeypatch.setattr(bot_complete.multiprocessing, 'Process', lambda *args, **kwargs: started.append(kwargs))
+    bot_complete.main()
+    assert started == []
+
+
+def test_worker_paths():
+    assert bot_complete.worker_path('file_ids.json', 0) == 'file_ids.json'
+    assert bot_complete.worker_path('file_ids.json', 2) == 'file_ids.2.json'
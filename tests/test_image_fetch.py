@@ -0,0 +1,80 @@
+import asyncio
+import io
+import random
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import bot_complete
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def noisy_jpeg(size=(236, 236), **options) -> bytes:
+    """Шумная картинка: JPEG выходит на десятки КБ, больше одного сетевого куска"""
+    rnd = random.Random(1)
+    image = PIL.frombytes('RGB', size, bytes(rnd.randrange(256) for _ in range(size[0] * size[1] * 3)))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=95, **options)
+    return out.getvalue()
+
+
+async def serve_chunked(body: bytes, chunk: int = 4096):
+    """Сервер, отдающий тело кусками с паузами — как медленная сеть"""
+    async def handler(request):
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for pos in range(0, len(body), chunk):
+            await resp.write(body[pos:pos + chunk])
+            await asyncio.sleep(0.005)
+        await resp.write_eof()
+        return resp
+
+    app = web.Application()
+    app.router.add_get('/{name}', handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_thumbnail_streamed_in_chunks_gets_hashed(workdir, monkeypatch):
+    monkeypatch.setattr(bot_complete, 'thumbnail_url', lambda url: url)
+    body = noisy_jpeg()
+    assert len(body) > 16 * 4096
+
+    async def main():
+        server = await serve_chunked(body)
+        session = bot_complete.PinterestSession(bot_complete.MemoryState(seen_file='seen.bin'),
+                                                image_hashes_file='hashes.bin')
+        session.http = aiohttp.ClientSession()
+        try:
+            return await session.image_group(str(server.make_url('/a.jpg'))), session.image_hashes.stats
+        finally:
+            await session.http.close()
+            await server.close()
+
+    group, stats = asyncio.run(main())
+    assert group == bot_complete.dhash(body)
+    assert stats['failed'] == 0
+
+
+def test_probe_finds_jpeg_size_behind_large_metadata(workdir):
+    # ICC-профиль в 20 КБ отодвигает SOF за первый сетевой кусок
+    body = noisy_jpeg((320, 180), icc_profile=b'\0' * 20000)
+    assert body.index(b'\xff\xc0') > 4096
+
+    async def main():
+        server = await serve_chunked(body)
+        session = bot_complete.PinterestSession(bot_complete.MemoryState(seen_file='seen.bin'),
+                                                image_hashes_file='hashes.bin')
+        session.http = aiohttp.ClientSession()
+        try:
+            url = str(server.make_url('/b.jpg'))
+            return await session.probe_image_size(url), session.image_sizes.get(url)
+        finally:
+            await session.http.close()
+            await server.close()
+
+    assert asyncio.run(main()) == ((320, 180), (320, 180))
@@ -0,0 +1,53 @@
+import io
+
+import pytest
+
+from bot_complete import image_size_from_header
+
+PIL = pytest.importorskip('PIL.Image')
+
+
+def encode(fmt, size=(123, 45), mode='RGB', **options) -> bytes:
+    out = io.BytesIO()
+    PIL.new(mode, size, 'red' if mode == 'RGB' else (255, 0, 0, 128)).save(out, fmt, **options)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('fmt, mode, options, chunk', [
+    ('JPEG', 'RGB', {}, None),
+    ('JPEG', 'RGB', {'progressive': True}, None),
+    ('PNG', 'RGB', {}, None),
+    ('GIF', 'RGB', {}, None),
+    ('WEBP', 'RGB', {'lossless': False}, b'VP8 '),
+    ('WEBP', 'RGB', {'lossless': True}, b'VP8L'),
+    ('WEBP', 'RGBA', {'lossless': False}, b'VP8X'),
+])
+def test_size_from_header(fmt, mode, options, chunk):
+    data = encode(fmt, mode=mode, **options)
+    if chunk:
+        assert data[12:16] == chunk
+    assert image_size_from_header(data) == (123, 45)
+    assert image_size_from_header(data[:64 * 1024]) == (123, 45)
+
+
+def test_jpeg_progressive_marker_is_sof2():
+    data = encode('JPEG', progressive=True)
+    assert b'\xff\xc2' in data and b'\xff\xc0' not in data
+    assert image_size_from_header(data) == (123, 45)
+
+
+@pytest.mark.parametrize('fmt, mode, options', [
+    ('JPEG', 'RGB', {}), ('PNG', 'RGB', {}), ('GIF', 'RGB', {}),
+    ('WEBP', 'RGB', {}), ('WEBP', 'RGB', {'lossless': True}), ('WEBP', 'RGBA', {}),
+])
+def test_truncated_header_gives_none(fmt, mode, options):
+    data = encode(fmt, mode=mode, **options)
+    # Обрезаем перед размерами: разбор не должен ни упасть, ни выдумать размер
+    cut = data.index(b'\xff\xc0') + 6 if fmt == 'JPEG' else {'PNG': 20, 'GIF': 8, 'WEBP': 26}[fmt]
+    assert image_size_from_header(data[:cut]) is None
+
+
+def test_unknown_data_gives_none():
+    assert image_size_from_header(b'') is None
+    assert image_size_from_header(b'<html>not an image</html>') is None
+    assert image_size_from_header(b'\xff\xd8\x00\x00garbage') is None
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+import bot_complete
+
+
+def legacy_file(path, notes=3):
+    data = {'notes': [{'title': f'Заметка {i}', 'content': 'текст'} for i in range(notes)],
+            'game_settings': {'CS2': [{'name': 'sens', 'value': '1.5'}]}}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def broken_records(good):
+    for i in range(good):
+        yield 'notes', {'title': str(i)}, '', '1'
+    raise RuntimeError('падение посреди переноса')
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_interrupted_import_leaves_storage_empty(workdir, backend):
+    storage_class, suffix = bot_complete.STORAGE_BACKENDS[backend]
+    storage = storage_class('bot_data' + suffix)
+    with pytest.raises(RuntimeError):
+        storage.import_items(broken_records(5))
+    assert storage.is_empty()
+    assert storage.import_items([('notes', {'title': 'a'}, '', '1')]) == 1
+    assert storage.count('notes', '', '1') == 1
+    storage.close()
+
+
+def test_sqlite_import_rolls_back_on_database_error(workdir):
+    storage = bot_complete.SqliteStorage('bot_data.sqlite3')
+    records = [('notes', {'title': 'a'}, '', '1'), ('notes', {'title': 'b'}, '', object())]
+    with pytest.raises(Exception):
+        storage.import_items(records)
+    assert storage.is_empty()
+    storage.close()
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_migrate_moves_legacy_file_to_owner(workdir, backend):
+    manager = bot_complete.DataManager('bot_data.json', backend)
+    legacy_file('bot_data.json')
+    manager.migrate('123')
+    assert manager.count_items('notes', '123') == 3
+    assert manager.count_items('game_settings', '123', 'CS2') == 1
+    assert (workdir / 'bot_data.json.migrated').exists()
+    manager.close()
+
+
+def test_migrate_without_owner_keeps_legacy_file(workdir, monkeypatch):
+    monkeypatch.setattr(bot_complete, 'LEGACY_OWNER', '')
+    legacy_file('bot_data.json')
+    manager = bot_complete.DataManager('bot_data.json')
+    assert manager.storage.is_empty()
+    assert (workdir / 'bot_data.json').exists()
+
+    monkeypatch.setattr(bot_complete, 'LEGACY_OWNER', '123')
+    manager.migrate()
+    assert manager.count_items('notes', '123') == 3
+    assert manager.count_items('notes', '') == 0
+    manager.close()
@@ -0,0 +1,53 @@
+import asyncio
+
+import bot_complete
+
+
+class HangingHttp:
+    """HTTP-сессия, которая никогда не отвечает"""
+    closed = False
+
+    def get(self, *args, **kwargs):
+        return self
+
+    async def __aenter__(self):
+        await asyncio.Event().wait()
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def test_cancel_while_waiting_for_bucket_releases_identity_and_probe(workdir):
+    async def main():
+        session = bot_complete.PinterestSession(bot_complete.MemoryState(seen_file='seen.bin'))
+        session.http = HangingHttp()
+        identity = session.cookie_pool.add('a', {})
+        identity.bucket.tokens = -10  # следующий запрос ждет в ведре
+        session.breaker.state = bot_complete.CircuitBreaker.HALF_OPEN
+
+        task = asyncio.create_task(session.fetch(identity, 'http://pinterest.invalid/'))
+        await asyncio.sleep(0.05)
+        assert session.breaker.probing and identity.in_flight == 1
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return identity, session.breaker
+
+    identity, breaker = asyncio.run(main())
+    assert identity.in_flight == 0
+    assert identity.stats['errors'] == 0
+    assert not breaker.probing
+    assert breaker.allow()
+
+
+def test_cancel_during_request_releases_identity(workdir):
+    async def main():
+        session = bot_complete.PinterestSession(bot_complete.MemoryState(seen_file='seen.bin'))
+        session.http = HangingHttp()
+        identity = session.cookie_pool.add('a', {})
+        task = asyncio.create_task(session.fetch(identity, 'http://pinterest.invalid/'))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return identity
+
+    assert asyncio.run(main()).in_flight == 0
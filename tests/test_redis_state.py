@@ -0,0 +1,91 @@
+"""RedisState против fakeredis — локальной замены Redis, говорящей по тому же протоколу"""
+import asyncio
+
+import pytest
+
+import bot_complete
+
+pytest.importorskip('fakeredis')
+
+
+def run(redis_url, scenario):
+    async def main():
+        state = bot_complete.RedisState(redis_url, prefix=f'test{id(scenario)}:')
+        try:
+            return await scenario(state)
+        finally:
+            await state.close()
+    return asyncio.run(main())
+
+
+def test_user_state_roundtrip(redis_url):
+    async def scenario(state):
+        await state.set_user_state('1', {'waiting_for': 'note'})
+        first = await state.get_user_state('1')
+        await state.set_user_state('1', {})
+        return first, await state.get_user_state('1')
+
+    assert run(redis_url, scenario) == ({'waiting_for': 'note'}, {})
+
+
+def test_seen_forgets_oldest(redis_url):
+    async def scenario(state):
+        state.seen_capacity = 3
+        await state.mark_seen('1', 'avatars', ['a', 'b'])
+        await state.mark_seen('1', 'avatars', ['c', 'd'])
+        return (await state.seen_many('1', 'avatars', ['a', 'b', 'c', 'd', 'e']),
+                await state.seen_many('1', 'wallpapers_pc', ['b']))
+
+    assert run(redis_url, scenario) == ([False, True, True, True, False], [False])
+
+
+def test_pool_capacity(redis_url):
+    async def scenario(state):
+        await state.pool_put('avatars', ['x', 'y', 'z'], 60, 2)
+        return await state.pool_get('avatars')
+
+    assert run(redis_url, scenario) == ['y', 'z']
+
+
+def test_pool_ttl(redis_url):
+    async def scenario(state):
+        await state.pool_put('wallpapers_pc', ['old'], 0.05, 10)
+        await asyncio.sleep(0.1)
+        return await state.pool_get('wallpapers_pc'), state.expired
+
+    assert run(redis_url, scenario) == ([], 1)
+
+
+def test_cookies_shared(redis_url):
+    async def scenario(state):
+        await state.set_cookies({'abc': {'sid': '1'}})
+        return await state.get_cookies()
+
+    assert run(redis_url, scenario) == {'abc': {'sid': '1'}}
+
+
+
+def test_close_closes_connections_checked_out_by_commands(redis_url):
+    async def main():
+        client = bot_complete.RedisClient(redis_url, pool_size=4)
+        busy = await client._acquire()             # одно соединение занято командой
+        await client.execute('PING')               # другое свободно в пуле
+        idle = client.idle[0]
+        await client.close()
+        closed = busy[1].is_closing(), idle[1].is_closing(), len(client.conns)
+        await client._release(busy)                # команда досчиталась после close
+        with pytest.raises(bot_complete.RedisError):
+            await client.execute('PING')
+        return closed, client.idle
+
+    assert asyncio.run(main()) == ((True, True, 0), [])
+
+
+def test_failed_auth_does_not_leak_the_connection(redis_url):
+    async def main():
+        client = bot_complete.RedisClient(redis_url.replace('redis://', 'redis://:wrong@'))
+        with pytest.raises(bot_complete.RedisError):
+            await client.execute('PING')
+        return client.conns, client.created
+
+    assert asyncio.run(main()) == (set(), 0)
@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+import bot_complete
+
+
+def fill(dm):
+    dm.add_item('notes', {'title': 'Прицел для CS2', 'content': 'зеленая точка'}, user='1')
+    dm.add_item('notes', {'title': 'Заметка', 'content': 'купить прицел'}, user='1')
+    dm.add_item('files', {'name': 'config_прицел.cfg'}, user='1')
+    dm.add_item('game_settings', {'name': 'sens', 'value': '1.5'}, 'Valorant', user='1')
+    dm.add_item('notes', {'title': 'Прицел чужой'}, user='2')
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_search_ranks_prefix_and_all_words(workdir, backend):
+    dm = bot_complete.DataManager('bot_data.json', backend)
+    fill(dm)
+    ids = [item_id for item_id, *_ in dm.search('1', 'прицелы')]
+    assert ids == [3, 1, 2]  # имя и заголовок весят больше содержимого, при равенстве — новее выше
+    assert [title for *_, title in dm.search('1', 'прицел cs')] == ['Прицел для CS2']
+    assert dm.search('1', 'valor')[0][1:] == ('game_settings', 'Valorant', 'sens: 1.5')
+    assert dm.search('1', 'прицел чужой') == []
+    assert dm.delete_item('notes', 0, user='1')
+    assert [item_id for item_id, *_ in dm.search('1', 'прицел')] == [3, 2]
+    dm.close()
+
+
+@pytest.mark.parametrize('backend', ['sqlite', 'journal'])
+def test_index_persists_per_user_and_rebuilds_when_stale(workdir, backend):
+    dm = bot_complete.DataManager('bot_data.json', backend)
+    fill(dm)
+    dm.close()
+
+    dm = bot_complete.DataManager('bot_data.json', backend)
+    assert dm.index_synced('1') and dm.index_synced('2')
+    assert len(dm.search('1', 'прицел')) == 3
+    # Запись мимо индекса (другой процесс, падение до сохранения) — индекс перестроится при поиске
+    dm.storage.add('notes', {'title': 'Прицел новый'}, '', '1')
+    assert not dm.index_synced('1')
+    assert len(dm.search('1', 'прицел')) == 4
+    assert dm.index_synced('1')
+    dm.close()
+
+
+def test_journal_index_lives_next_to_user_journal(workdir):
+    dm = bot_complete.DataManager('bot_data.json', 'journal')
+    fill(dm)
+    dm.save()
+    files = sorted(os.listdir('bot_data_journal'))
+    assert '1.journal.index' in files and '2.journal.index' in files
+    dm.close()
+    assert not os.path.exists('bot_data.index.json')
@@ -0,0 +1,57 @@
+import asyncio
+import time
+from datetime import datetime
+
+from telegram import Chat, Message, Update, User
+
+import bot_complete
+
+
+def message_update(update_id: int, user_id: int) -> Update:
+    chat = Chat(user_id, Chat.PRIVATE)
+    user = User(user_id, f'user{user_id}', False)
+    return Update(update_id, message=Message(update_id, datetime.now(), chat, from_user=user, text='x'))
+
+
+def test_slow_user_does_not_block_others():
+    async def main():
+        processor = bot_complete.PerUserUpdateProcessor(4)
+        started = time.perf_counter()
+        order = []
+        finished = {}
+
+        async def handle(name, delay):
+            await asyncio.sleep(delay)
+            order.append(name)
+            finished[name] = time.perf_counter() - started
+
+        tasks = [asyncio.create_task(processor.process_update(message_update(1, 1), handle('a1', 0.5)))]
+        tasks += [asyncio.create_task(processor.process_update(message_update(i, 1), handle(f'a{i}', 0)))
+                  for i in range(2, 6)]
+        await asyncio.sleep(0.01)
+        tasks.append(asyncio.create_task(processor.process_update(message_update(10, 2), handle('b', 0))))
+        await asyncio.gather(*tasks)
+        return order, finished
+
+    order, finished = asyncio.run(main())
+    assert finished['b'] < 0.2
+    # Апдейты одного пользователя — строго по порядку
+    assert [name for name in order if name.startswith('a')] == ['a1', 'a2', 'a3', 'a4', 'a5']
+
+
+def test_workers_limit_concurrency():
+    async def main():
+        processor = bot_complete.PerUserUpdateProcessor(2)
+        running = peak = 0
+
+        async def handle():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(message_update(i, i), handle()) for i in range(1, 7)))
+        return peak
+
+    assert asyncio.run(main()) == 2
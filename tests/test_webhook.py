@@ -0,0 +1,66 @@
+import asyncio
+import types
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import bot_complete
+
+SECRET = 's3cret'
+
+
+def run(check, ready=True):
+    async def main():
+        application = types.SimpleNamespace(bot=None, update_queue=asyncio.Queue(), running=True)
+        server = bot_complete.WebhookServer(application, '/hook', SECRET)
+        server.ready = ready
+        async with TestClient(TestServer(server.app)) as client:
+            await check(client, application.update_queue)
+
+    asyncio.run(main())
+
+
+def post(client, body, token=SECRET, **kwargs):
+    return client.post('/hook', data=body, headers={'X-Telegram-Bot-Api-Secret-Token': token}, **kwargs)
+
+
+def test_wrong_or_non_ascii_secret_is_forbidden():
+    async def check(client, queue):
+        for token in ('', 'wrong', 'sécret'):
+            resp = await post(client, '{"update_id": 1}', token)
+            assert resp.status == 403
+        resp = await post(client, '{"update_id": 1}', b'\xff\xfe'.decode('latin-1'))
+        assert resp.status == 403
+        assert queue.empty()
+
+    run(check)
+
+
+def test_malformed_bodies_are_bad_requests():
+    bodies = ['not json', '[1, 2]', '"x"', '1', 'null', '{}', '{"update_id": 1, "message": 5}',
+              '{"update_id": 1, "message": [1]}', b'\xff\xfe']
+
+    async def check(client, queue):
+        for body in bodies:
+            resp = await post(client, body)
+            assert resp.status == 400, body
+        assert queue.empty()
+
+    run(check)
+
+
+def test_valid_update_is_queued():
+    async def check(client, queue):
+        resp = await post(client, '{"update_id": 7}')
+        assert resp.status == 200
+        update = queue.get_nowait()
+        assert update.update_id == 7
+
+    run(check)
+
+
+def test_not_ready_asks_telegram_to_retry():
+    async def check(client, queue):
+        assert (await post(client, '{"update_id": 7}')).status == 503
+        assert queue.empty()
+
+    run(check, ready=False)